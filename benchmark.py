@@ -0,0 +1,324 @@
+import argparse
+import functools
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import overlaps
+import pipeline
+import script
+
+# Where benchmark results are written, one JSON file per run
+BENCHMARK_RESULTS_DIR = 'benchmark_results'
+
+# Share of synthetic school names that get a typo or an abbreviation swap
+NAME_PERTURBATION_RATE = 0.1
+
+# Name variations that defeat the exact merge but should still fuzzy match
+NAME_SWAPS = [
+    ('P.S. ', 'PS '),
+    ('PS ', 'P.S. '),
+    ('I.S. ', 'IS '),
+    ('J.H.S. ', 'JHS '),
+    (' School', ''),
+    ('Academy', 'Acad.'),
+]
+
+# Subcommands whose startup is measured, and the geometry modules each one is checked for
+STARTUP_COMMANDS = ['match', 'unzoned', 'zones', 'overlaps', 'export']
+GEOMETRY_MODULES = ['geopandas', 'shapely']
+
+# Pipeline phases reported by the benchmark, in pipeline order
+PHASES = ['csv_load', 'name_cleaning', 'exact_merge', 'fuzzy_match', 'wkt_parse', 'overlap', 'enrichment', 'export']
+
+# Stage time not spent in a nested phase is reported under these phases
+STAGE_PHASES = {
+    'zone_dbns': 'csv_load',
+    'zones': 'wkt_parse',
+    'rankings': 'name_cleaning',
+    'schools': 'exact_merge',
+    'matching': 'exact_merge',
+    'school_table': 'enrichment',
+    'zone_geometry': 'wkt_parse',
+    'overlaps': 'overlap',
+    'overlap_report': 'enrichment',
+    'chains': 'overlap',
+    'unzoned': 'export',
+    'site_export': 'export',
+}
+
+
+def _perturb_name(name, rng):
+    """Introduce a realistic variation in a school name: an abbreviation swap or a typo"""
+    for old, new in rng.sample(NAME_SWAPS, len(NAME_SWAPS)):
+        if old in name:
+            return name.replace(old, new, 1)
+
+    # No swap applies, drop one letter from the last word instead
+    position = name.rfind(' ') + 2
+    if position < len(name):
+        return name[:position] + name[position + 1:]
+    return name
+
+
+def _tile_names(names, tile, rng):
+    """School names for one tile, with a tile suffix and a share of perturbed names"""
+    if tile == 0:
+        return names
+    tiled = []
+    for name in names:
+        if pd.isna(name):
+            tiled.append(name)
+            continue
+        name = f"{name} Campus {tile}"
+        if rng.random() < NAME_PERTURBATION_RATE:
+            name = _perturb_name(name, rng)
+        tiled.append(name)
+    return tiled
+
+
+def _tile_dbns(dbns, tile):
+    """DBNs for one tile, tile 0 keeps the real ones"""
+    if tile == 0:
+        return dbns
+    return dbns.map(lambda dbn: dbn if pd.isna(dbn) else f"T{tile}{dbn}")
+
+
+def _tile_offsets(scale, bounds):
+    """Translation of each tile, tiles sit on a grid next to the real city so they never overlap"""
+    minx, miny, maxx, maxy = bounds
+    columns = math.ceil(math.sqrt(scale))
+    width = (maxx - minx) * 1.05
+    height = (maxy - miny) * 1.05
+    return [((tile % columns) * width, (tile // columns) * height) for tile in range(scale)]
+
+
+def generate_synthetic_inputs(scale, output_dir, seed=0):
+    """Write synthetic inputs at scale times the shipped data into output_dir
+
+    Zone polygons are tiled on a grid next to the real city and jittered slightly, school DBNs
+    and names get a tile suffix, and a share of the names are perturbed so the fuzzy matcher
+    has work to do. Files use the same relative paths as the real inputs.
+    """
+    rng = random.Random(seed)
+    jitter = np.random.default_rng(seed)
+
+    zone_files = [script.ELEMENTARY_ZONES_FILE, script.MIDDLE_ZONES_FILE, script.HIGH_ZONES_FILE]
+    zone_dfs = {path: pd.read_csv(path) for path in zone_files}
+    geometries = {path: shapely.from_wkt(zones_df['the_geom'].values) for path, zones_df in zone_dfs.items()}
+    bounds = shapely.total_bounds(np.concatenate(list(geometries.values())))
+    offsets = _tile_offsets(scale, bounds)
+
+    for path, zones_df in zone_dfs.items():
+        tiles = []
+        for tile, (dx, dy) in enumerate(offsets):
+            tile_df = zones_df.copy()
+            if tile > 0:
+                # Grid offset plus a small random jitter so tiles aren't exact copies
+                dx += jitter.uniform(-5e-4, 5e-4)
+                dy += jitter.uniform(-5e-4, 5e-4)
+                moved = shapely.transform(geometries[path], lambda coords: coords + [dx, dy])
+                tile_df['the_geom'] = shapely.to_wkt(moved, rounding_precision=-1)
+            tile_df['DBN'] = _tile_dbns(tile_df['DBN'], tile)
+            tiles.append(tile_df)
+        _write_csv(pd.concat(tiles, ignore_index=True), output_dir, path)
+
+    lcgms_df = pd.read_csv(script.LCGMS_FILE)
+    tiles = []
+    for tile in range(scale):
+        tile_df = lcgms_df.copy()
+        tile_df['ATS System Code'] = _tile_dbns(tile_df['ATS System Code'], tile)
+        tile_df['Location Name'] = _tile_names(tile_df['Location Name'].tolist(), tile, rng)
+        tiles.append(tile_df)
+    _write_csv(pd.concat(tiles, ignore_index=True), output_dir, script.LCGMS_FILE)
+
+    for path in [script.ELEMENTARY_RANKINGS_FILE, script.MIDDLE_RANKINGS_FILE, script.HIGH_RANKINGS_FILE]:
+        rankings_df = pd.read_csv(path)
+        tiles = []
+        for tile in range(scale):
+            tile_df = rankings_df.copy()
+            tile_df['School Name'] = _tile_names(tile_df['School Name'].tolist(), tile, rng)
+            # Interleave ranks so every tile spans the whole ranking
+            tile_df['State Rank'] = (tile_df['State Rank'] - 1) * scale + tile + 1
+            tile_df['Total Schools'] = tile_df['Total Schools'] * scale
+            tiles.append(tile_df)
+        _write_csv(pd.concat(tiles, ignore_index=True).sort_values('State Rank'), output_dir, path)
+
+
+def _write_csv(df, output_dir, relative_path):
+    path = os.path.join(output_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False)
+
+
+class PhaseTimer:
+    """Wall time per phase, nested phases are subtracted from the phase that called them"""
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self._stack = []
+
+    def wrap(self, phase, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            self._stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = self._stack.pop()
+                self.seconds[phase] += elapsed - nested
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return timed
+
+
+def _patch(target, attribute, replacement, patched):
+    patched.append((target, attribute, getattr(target, attribute)))
+    setattr(target, attribute, replacement)
+
+
+def run_benchmark(scale, data_dir):
+    """Run every pipeline stage on the inputs in data_dir and time each phase"""
+    timer = PhaseTimer()
+    patched = []
+    _patch(pd, 'read_csv', timer.wrap('csv_load', pd.read_csv), patched)
+    _patch(pd.DataFrame, 'to_csv', timer.wrap('export', pd.DataFrame.to_csv), patched)
+    _patch(shapely, 'from_wkt', timer.wrap('wkt_parse', shapely.from_wkt), patched)
+    _patch(script, 'clean_school_names', timer.wrap('name_cleaning', script.clean_school_names), patched)
+    _patch(script, 'fuzzy_match_rankings', timer.wrap('fuzzy_match', script.fuzzy_match_rankings), patched)
+    # The overlaps stage imports find_zone_overlaps when it runs, so the module attribute is patched
+    _patch(overlaps, 'find_zone_overlaps', timer.wrap('overlap', overlaps.find_zone_overlaps), patched)
+
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    try:
+        # Call the stage functions directly so stage cache reads and writes aren't timed.
+        # The zone geometry cache lives in data_dir, so WKT is always parsed cold.
+        results = {}
+        start = time.perf_counter()
+        for name in pipeline.stage_order(list(pipeline.STAGES)):
+            spec = pipeline.STAGES[name]
+            func = timer.wrap(STAGE_PHASES.get(name, 'enrichment'), spec['func'])
+            results[name] = func(**{dependency: results[dependency] for dependency in spec['inputs']})
+        total_seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        for target, attribute, original in reversed(patched):
+            setattr(target, attribute, original)
+
+    return {
+        'scale': scale,
+        'total_seconds': total_seconds,
+        'phase_seconds': timer.seconds,
+        'rows': {
+            'elementary_zones': len(results['zones']['elementary']),
+            'middle_zones': len(results['zones']['middle']),
+            'lcgms': len(results['schools']),
+            'elementary_rankings': len(results['rankings']['elementary']),
+            'middle_rankings': len(results['rankings']['middle']),
+            'high_rankings': len(results['rankings']['high']),
+            'zoned_schools': len(results['matching']),
+            'overlapping_zone_pairs': len(results['overlaps']),
+            'overlap_report_rows': len(results['overlap_report']),
+            'unzoned_schools': len(results['unzoned']),
+        },
+    }
+
+
+def measure_startup(command):
+    """Wall time, import time and geometry modules loaded by one script.py subcommand run
+
+    The command runs in a fresh interpreter under -X importtime. Run the pipeline once
+    beforehand so the stages are cached and the timing is mostly startup.
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', 'script.py', command],
+                               capture_output=True, text=True, check=True)
+    wall_seconds = time.perf_counter() - start
+
+    # Lines look like 'import time:  self [us] | cumulative | package', nested imports are indented
+    import_microseconds = 0
+    modules = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        modules.add(package.strip())
+        if not package.startswith('  '):
+            import_microseconds += int(cumulative)
+
+    return {
+        'command': command,
+        'wall_seconds': wall_seconds,
+        'import_seconds': import_microseconds / 1e6,
+        'modules': len(modules),
+        'geometry_modules': [module for module in GEOMETRY_MODULES if module in modules],
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic inputs at several scales')
+    parser.add_argument('--scales', default='1,10,100', help='comma separated scale factors (default: 1,10,100)')
+    parser.add_argument('--output', help=f'results JSON file (default: {BENCHMARK_RESULTS_DIR}/<commit>.json)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    parser.add_argument('--startup', action='store_true',
+                        help='instead, time the startup of each script.py subcommand and list the geometry modules it imports')
+    args = parser.parse_args()
+
+    if args.startup:
+        for command in STARTUP_COMMANDS:
+            result = measure_startup(command)
+            print(f"{command:<10}{result['wall_seconds']:>7.2f}s wall, {result['import_seconds']:.2f}s importing "
+                  f"{result['modules']} modules, geometry modules: {', '.join(result['geometry_modules']) or 'none'}")
+        return
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'shapely': shapely.__version__,
+        'results': [],
+    }
+
+    for scale in [int(value) for value in args.scales.split(',')]:
+        with tempfile.TemporaryDirectory() as data_dir:
+            start = time.perf_counter()
+            generate_synthetic_inputs(scale, data_dir, seed=args.seed)
+            print(f"\nGenerated {scale}x synthetic inputs in {time.perf_counter() - start:.1f}s")
+            result = run_benchmark(scale, data_dir)
+        report['results'].append(result)
+
+        print(f"\n{scale}x: {result['total_seconds']:.2f}s total")
+        for phase in PHASES:
+            print(f"  {phase:<14}{result['phase_seconds'][phase]:>10.3f}s")
+
+    output = args.output or os.path.join(BENCHMARK_RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
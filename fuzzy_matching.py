@@ -0,0 +1,243 @@
+import difflib
+import time
+
+import numpy as np
+import pandas as pd
+
+from profiling import count
+
+# Same cutoff we always used with difflib.get_close_matches, good balance for school names
+FUZZY_CUTOFF = 0.85
+
+NGRAM_SIZE = 3
+
+
+def _ngram_counts(name):
+    """Padded character n-grams of a clean name with their multiplicities"""
+    padded = '\x00' * (NGRAM_SIZE - 1) + name + '\x00' * (NGRAM_SIZE - 1)
+    counts = {}
+    for i in range(len(padded) - NGRAM_SIZE + 1):
+        gram = padded[i:i + NGRAM_SIZE]
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def build_name_index(names):
+    """Build the n-gram inverted index and character counts over candidate clean names"""
+    names = list(dict.fromkeys(name for name in names if name))
+
+    postings = {}
+    for position, name in enumerate(names):
+        for gram, count in _ngram_counts(name).items():
+            postings.setdefault(gram, ([], []))
+            postings[gram][0].append(position)
+            postings[gram][1].append(count)
+
+    # Character count matrix gives difflib's quick_ratio for many candidates at once
+    alphabet = {char: column for column, char in enumerate(sorted(set(''.join(names))))}
+    char_counts = np.zeros((len(names), len(alphabet)), dtype=np.int32)
+    for position, name in enumerate(names):
+        for char in name:
+            char_counts[position, alphabet[char]] += 1
+
+    return {
+        'names': names,
+        'lengths': np.array([len(name) for name in names], dtype=np.int64),
+        'postings': {gram: (np.array(ids), np.array(counts)) for gram, (ids, counts) in postings.items()},
+        'alphabet': alphabet,
+        'char_counts': char_counts,
+    }
+
+
+def _candidate_positions(name, index, cutoff):
+    """Candidates that can still reach the cutoff, found through the n-gram index
+
+    A ratio of at least cutoff means at most (1 - cutoff) * (len(a) + len(b)) insertions and
+    deletions turn one name into the other. Each edit touches at most NGRAM_SIZE padded grams,
+    so a candidate sharing fewer grams than the resulting bound can never match (q-gram lemma).
+    """
+    lengths = index['lengths']
+    total = lengths + len(name)
+
+    shared = np.zeros(len(lengths), dtype=np.int64)
+    for gram, count in _ngram_counts(name).items():
+        if gram in index['postings']:
+            ids, counts = index['postings'][gram]
+            shared[ids] += np.minimum(counts, count)
+
+    max_edits = np.floor((1 - cutoff) * total + 1e-9)
+    required = np.maximum(lengths, len(name)) + NGRAM_SIZE - 1 - NGRAM_SIZE * max_edits
+
+    # real_quick_ratio filter on the lengths alone, same as difflib applies first
+    possible = 2.0 * np.minimum(lengths, len(name)) / total >= cutoff
+    return np.flatnonzero(possible & (shared >= required))
+
+
+def best_match(name, index, cutoff=FUZZY_CUTOFF, stats=None):
+    """Best candidate for one name, scored exactly like difflib.get_close_matches(n=1)
+
+    Returns a (matched name, score) tuple, or None when nothing reaches the cutoff.
+    When a stats dict is given, the candidates admitted by the index and the candidates
+    scored with the exact ratio are added to it.
+    """
+    positions = _candidate_positions(name, index, cutoff)
+    if stats is not None:
+        stats['index_candidates'] = stats.get('index_candidates', 0) + len(positions)
+    if len(positions) == 0:
+        return None
+
+    # quick_ratio filter, vectorized over the candidates
+    query_counts = np.zeros(len(index['alphabet']), dtype=np.int32)
+    for char in name:
+        if char in index['alphabet']:
+            query_counts[index['alphabet'][char]] += 1
+    common = np.minimum(index['char_counts'][positions], query_counts).sum(axis=1)
+    positions = positions[2.0 * common / (index['lengths'][positions] + len(name)) >= cutoff]
+    if stats is not None:
+        stats['scored_candidates'] = stats.get('scored_candidates', 0) + len(positions)
+
+    # Exact ratio on the survivors, same argument order and tie-breaking as difflib
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(name)
+    best = None
+    for position in positions:
+        candidate = index['names'][position]
+        matcher.set_seq1(candidate)
+        score = matcher.ratio()
+        if score >= cutoff and (best is None or (score, candidate) > best):
+            best = (score, candidate)
+
+    if best is None:
+        return None
+    return best[1], best[0]
+
+
+def find_fuzzy_matches(names, candidates, cutoff=FUZZY_CUTOFF):
+    """Fuzzy match a Series of clean names against candidate clean names in one batch
+
+    Returns a DataFrame indexed like names with 'Matched Name' and 'Score' columns,
+    holding only the rows that found a match. Repeated names are scored once.
+    """
+    index = build_name_index(candidates)
+
+    results = {}
+    stats = {}
+    queried = 0
+    for name in names.dropna().unique():
+        if not name:
+            continue
+        queried += 1
+        match = best_match(name, index, cutoff, stats)
+        if match is not None:
+            results[name] = match
+
+    count('fuzzy_names', queried)
+    count('fuzzy_index_candidates', stats.get('index_candidates', 0))
+    count('fuzzy_scored_candidates', stats.get('scored_candidates', 0))
+    count('fuzzy_matches', len(results))
+
+    matched = names[names.isin(list(results))]
+    return pd.DataFrame({
+        'Matched Name': [results[name][0] for name in matched],
+        'Score': [results[name][1] for name in matched],
+    }, index=matched.index)
+
+
+def fuzzy_match_rankings(zoned_df, ranking_df, rank_col_name, store=None, source=None):
+    """Fill missing ranks in zoned_df by fuzzy matching Clean Name against the ranking names
+
+    With a MatchStore, names it has already resolved for source are applied from it and only
+    the others are fuzzy matched, their results are recorded in the store.
+    """
+    # Identify unmatched schools
+    unmatched_mask = zoned_df[rank_col_name].isna()
+    unmatched_schools = zoned_df[unmatched_mask]
+
+    # Get available ranking names that haven't been matched
+    matched_names = set(zoned_df[~unmatched_mask]['Clean Name'])
+    available_rankings = ranking_df[~ranking_df['Clean Name'].isin(matched_names)]
+
+    if available_rankings.empty:
+        return zoned_df
+
+    ranking_names = available_rankings['Clean Name'].tolist()
+    ranking_map = dict(zip(available_rankings['Clean Name'], available_rankings['State Rank']))
+
+    unmatched_names = unmatched_schools['Clean Name']
+    if store is not None:
+        resolved = store.resolve(unmatched_names, source, ranking_names)
+        known = resolved[resolved['Resolved'] & resolved['Matched Name'].notna()]
+        zoned_df.loc[known.index, rank_col_name] = known['Matched Name'].map(ranking_map)
+        print(f"Resolved {resolved['Resolved'].sum()} schools from the match store, {len(known)} of them matched")
+        unmatched_names = unmatched_names[~resolved['Resolved']]
+
+    # Each distinct name is scored once
+    names = pd.Series([name for name in unmatched_names.dropna().unique() if name], dtype=object)
+    if names.empty:
+        # Nothing left to score, so the name index isn't built at all
+        print("No schools left to fuzzy match")
+        return zoned_df
+    print(f"Attempting fuzzy match for {len(unmatched_names)} schools against {len(ranking_names)} rankings...")
+
+    matches = find_fuzzy_matches(names, ranking_names)
+    if store is not None:
+        store.record(names, matches, source, ranking_names)
+
+    matched_by_name = pd.Series(matches['Matched Name'].to_numpy(), index=names[matches.index].to_numpy())
+    matched_schools = unmatched_names[unmatched_names.isin(matched_by_name.index)]
+    zoned_df.loc[matched_schools.index, rank_col_name] = matched_schools.map(matched_by_name).map(ranking_map)
+
+    print(f"Found {len(matched_schools)} additional matches via fuzzy matching")
+    return zoned_df
+
+
+def compare_with_difflib(names, candidates, cutoff=FUZZY_CUTOFF):
+    """Compare the indexed matcher with plain difflib.get_close_matches on the same names
+
+    Returns a DataFrame with one row per distinct name where either matcher found something,
+    and prints a summary of agreement and timings.
+    """
+    names = [name for name in pd.unique(pd.Series(names).dropna()) if name]
+    candidate_list = [name for name in candidates if name]
+
+    start = time.perf_counter()
+    expected = {}
+    for name in names:
+        matches = difflib.get_close_matches(name, candidate_list, n=1, cutoff=cutoff)
+        if matches:
+            expected[name] = matches[0]
+    difflib_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = find_fuzzy_matches(pd.Series(names), candidate_list, cutoff)
+    indexed = dict(zip(pd.Series(names)[found.index], found['Matched Name']))
+    indexed_seconds = time.perf_counter() - start
+
+    rows = [{
+        'Clean Name': name,
+        'Difflib Match': expected.get(name),
+        'Indexed Match': indexed.get(name),
+    } for name in names if name in expected or name in indexed]
+    report_df = pd.DataFrame(rows, columns=['Clean Name', 'Difflib Match', 'Indexed Match'])
+    agree = (report_df['Difflib Match'] == report_df['Indexed Match']).sum()
+
+    print(f"{len(names)} names vs {len(candidate_list)} candidates: difflib matched {len(expected)}, "
+          f"indexed matched {len(indexed)}, agreed on {agree}, "
+          f"missed {len(set(expected) - set(indexed))}")
+    print(f"difflib took {difflib_seconds:.2f}s, indexed matcher took {indexed_seconds:.2f}s")
+    return report_df
+
+
+if __name__ == "__main__":
+    # Recall report on the shipped data: every LCGMS name against each ranking file
+    from school_names import clean_school_names
+
+    lcgms_names = clean_school_names(pd.read_csv('GeneralSchoolData/LCGMS_SchoolData_20251130_1323.csv')['Location Name'])
+    for ranking_file in ['RankingData/SchoolDigger/ElementarySchools.csv', 'RankingData/SchoolDigger/MiddleSchools.csv',
+                         'RankingData/SchoolDigger/HighSchools.csv']:
+        ranking_names = clean_school_names(pd.read_csv(ranking_file)['School Name'])
+        print(f"\n{ranking_file}")
+        report_df = compare_with_difflib(lcgms_names, ranking_names.tolist())
+        disagreements = report_df[report_df['Difflib Match'] != report_df['Indexed Match']]
+        if not disagreements.empty:
+            print(disagreements.to_string(index=False))
@@ -0,0 +1,71 @@
+import hashlib
+import os
+import pickle
+import time
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from pipeline import file_hash
+
+# Parsed zone files are cached here, keyed by the hash of the source CSV
+ZONE_CACHE_DIR = os.path.join('.cache', 'zones')
+
+# Bump when the cached layout changes so old entries are ignored
+ZONE_CACHE_VERSION = 1
+
+
+def _cache_path(path, content_hash, cache_dir):
+    """Cache entry for a zone file, named after the file and a hash of its absolute path
+
+    Files with the same name in different directories, like snapshots of other years, get
+    separate entries and don't evict each other.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    path_hash = hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{stem}-{path_hash}-v{ZONE_CACHE_VERSION}-{content_hash[:16]}.pkl")
+
+
+def load_zones(path, cache_dir=ZONE_CACHE_DIR):
+    """Load a zone CSV as a GeoDataFrame, reusing the parsed geometry cache when the file is unchanged
+
+    The raw WKT column (the_geom) is dropped. Geometry is stored in the cache as WKB next to
+    the other columns, so warm runs skip both the CSV read and the WKT parse.
+    """
+    cache_path = _cache_path(path, file_hash(path), cache_dir)
+
+    if os.path.exists(cache_path):
+        start = time.perf_counter()
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        zones_gdf = gpd.GeoDataFrame(
+            cached['attributes'],
+            geometry=gpd.GeoSeries(shapely.from_wkb(cached['geometry_wkb']), index=cached['attributes'].index),
+        )
+        warm_seconds = time.perf_counter() - start
+        print(f"Loaded {len(zones_gdf)} zones from cache for {os.path.basename(path)} in {warm_seconds:.3f}s "
+              f"(cold parse took {cached['cold_seconds']:.3f}s)")
+        return zones_gdf
+
+    start = time.perf_counter()
+    zones_df = pd.read_csv(path)
+    geometry = shapely.from_wkt(zones_df['the_geom'].values)
+    attributes = zones_df.drop('the_geom', axis=1)
+    zones_gdf = gpd.GeoDataFrame(attributes, geometry=gpd.GeoSeries(geometry, index=attributes.index))
+    cold_seconds = time.perf_counter() - start
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Drop entries for older versions of the same file at the same path
+    stale_prefix = os.path.basename(cache_path).rsplit('-', 1)[0] + '-'
+    for name in os.listdir(cache_dir):
+        if name.startswith(stale_prefix):
+            os.remove(os.path.join(cache_dir, name))
+    with open(cache_path, 'wb') as f:
+        pickle.dump({
+            'attributes': attributes,
+            'geometry_wkb': shapely.to_wkb(geometry),
+            'cold_seconds': cold_seconds,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"Parsed {len(zones_gdf)} zones from WKT for {os.path.basename(path)} in {cold_seconds:.3f}s, cached to {cache_path}")
+    return zones_gdf
@@ -0,0 +1,79 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Typed schema for the LCGMS columns we know how to use.
+# Low-cardinality fields are categoricals, None keeps the type pandas infers.
+LCGMS_SCHEMA = {
+    'ATS System Code': 'str',
+    'Location Name': 'str',
+    'Location Category Description': 'category',
+    'Status Description': 'category',
+    'Primary Address': 'str',
+    'City': 'category',
+    'State Code': 'category',
+    'Zip': None,
+    'Geographical District Code': 'category',
+    'Administrative District Code': 'category',
+}
+
+# Columns the pipeline reads, the other 30 or so LCGMS columns are never loaded
+PIPELINE_COLUMNS = [
+    'ATS System Code',
+    'Location Name',
+    'Location Category Description',
+    'Primary Address',
+    'City',
+    'State Code',
+    'Zip',
+]
+
+# Rows per chunk in streaming mode
+LCGMS_CHUNK_SIZE = 50000
+
+
+def _dtypes(columns):
+    return {column: LCGMS_SCHEMA[column] for column in columns if LCGMS_SCHEMA.get(column) is not None}
+
+
+def _open_located(chunk):
+    """Rows for schools that are open and have a street address"""
+    return chunk[(chunk['Status Description'] == 'Open') & chunk['Primary Address'].notna()]
+
+
+def load_lcgms(path, columns=PIPELINE_COLUMNS, open_only=False, chunksize=None):
+    """Read only the given LCGMS columns with the typed schema
+
+    With open_only, rows are filtered to open schools with a street address. With chunksize,
+    the file is streamed in chunks and filtered as it is read, so a large multi-year snapshot
+    never has to fit in memory unfiltered.
+    """
+    read_columns = list(columns)
+    if open_only:
+        read_columns += [column for column in ['Status Description', 'Primary Address'] if column not in read_columns]
+
+    if chunksize is None:
+        lcgms_df = pd.read_csv(path, usecols=read_columns, dtype=_dtypes(read_columns))
+        if open_only:
+            lcgms_df = _open_located(lcgms_df)
+    else:
+        chunks = []
+        for chunk in pd.read_csv(path, usecols=read_columns, dtype=_dtypes(read_columns), chunksize=chunksize):
+            chunks.append(_open_located(chunk) if open_only else chunk)
+        lcgms_df = _concat_chunks(chunks, read_columns)
+
+    # Drop the filter-only columns again, keeping the file's column order
+    return lcgms_df[[column for column in lcgms_df.columns if column in columns]].reset_index(drop=True)
+
+
+def _concat_chunks(chunks, columns):
+    """Concatenate chunks, unioning categories so categorical columns stay categorical
+
+    An empty file, or a filter that leaves no chunks, gives an empty frame with the schema's types.
+    """
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=LCGMS_SCHEMA.get(column) or 'object') for column in columns})
+    lcgms_df = pd.concat(chunks, ignore_index=True)
+    for column, dtype in LCGMS_SCHEMA.items():
+        if dtype == 'category' and column in lcgms_df.columns:
+            lcgms_df[column] = union_categoricals([chunk[column] for chunk in chunks])
+    return lcgms_df
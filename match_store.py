@@ -0,0 +1,120 @@
+import hashlib
+import os
+
+import pandas as pd
+
+# Resolved ranking matches, kept next to the ranking data so manual entries can be reviewed
+MATCH_STORE_FILE = os.path.join('RankingData', 'match_resolutions.csv')
+
+MATCH_STORE_COLUMNS = ['Clean Name', 'Ranking Source', 'Matched Name', 'Score', 'Method', 'Candidates']
+MATCH_STORE_KEY = ['Clean Name', 'Ranking Source']
+
+# Methods: 'auto' entries come from the fuzzy matcher, 'manual' entries are curated by hand
+# and are never replaced. An entry without a Matched Name records that nothing matched.
+AUTO = 'auto'
+MANUAL = 'manual'
+
+
+def candidates_key(candidate_names):
+    """Short fingerprint of a set of ranking names"""
+    digest = hashlib.sha256('\n'.join(sorted(set(candidate_names))).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class MatchStore:
+    """On-disk store of how clean LCGMS names resolve against each ranking source
+
+    Each entry maps (Clean Name, Ranking Source) to the matched ranking name and its score,
+    or records that nothing matched. Entries are looked up in one join per ranking source,
+    so only names the store hasn't seen go through the fuzzy matcher.
+    """
+
+    def __init__(self, path=MATCH_STORE_FILE):
+        self.path = path
+        self.changed = False
+        if os.path.exists(path):
+            # Scores are written as their shortest repr, read them back to the same float
+            self.entries = pd.read_csv(path, dtype={column: 'str' for column in MATCH_STORE_COLUMNS if column != 'Score'},
+                                       float_precision='round_trip')
+        else:
+            self.entries = pd.DataFrame({column: pd.Series(dtype='float64' if column == 'Score' else 'str')
+                                         for column in MATCH_STORE_COLUMNS})
+        # Entries record() added or replaced since the store was loaded
+        self.recorded = self.entries.iloc[0:0]
+
+    def resolve(self, names, source, candidate_names):
+        """Stored resolutions for a Series of clean names, indexed like names
+
+        'Matched Name' is missing when nothing matched, 'Resolved' is False for names that
+        still need matching. A stored match counts while its ranking name is still among the
+        candidates. A stored no-match counts when it is manual, or while the candidates are the
+        ones it was scored against, since a new ranking name might match.
+        """
+        entries = self.entries[self.entries['Ranking Source'] == source]
+        entries = entries.drop_duplicates('Clean Name', keep='last').set_index('Clean Name')
+        resolved = entries.reindex(names.to_numpy()).set_index(names.index)
+
+        available = resolved['Matched Name'].isin(set(candidate_names))
+        no_match = resolved['Method'].notna() & resolved['Matched Name'].isna()
+        still_valid = (resolved['Method'] == MANUAL) | (resolved['Candidates'] == candidates_key(candidate_names))
+        resolved['Resolved'] = available | (no_match & still_valid)
+        resolved['Matched Name'] = resolved['Matched Name'].where(available)
+        return resolved[['Matched Name', 'Resolved']]
+
+    def record(self, names, matches, source, candidate_names):
+        """Add automatic entries for names that were just fuzzy matched, whether they matched or not
+
+        names is the Series of distinct names given to find_fuzzy_matches and matches its result.
+        Manual entries are never replaced.
+        """
+        new_entries = pd.DataFrame({
+            'Clean Name': names.to_numpy(),
+            'Ranking Source': source,
+            'Matched Name': matches['Matched Name'].reindex(names.index).to_numpy(),
+            'Score': matches['Score'].reindex(names.index).to_numpy(dtype='float64'),
+            'Method': AUTO,
+            'Candidates': candidates_key(candidate_names),
+        })
+        same_source = self.entries['Ranking Source'] == source
+        manual = self.entries[same_source & (self.entries['Method'] == MANUAL)]
+        new_entries = new_entries[~new_entries['Clean Name'].isin(manual['Clean Name'])]
+        if new_entries.empty:
+            return
+
+        replaced = same_source & self.entries['Clean Name'].isin(new_entries['Clean Name'])
+        self.entries = pd.concat([self.entries[~replaced], new_entries], ignore_index=True)
+        recorded_replaced = (self.recorded['Ranking Source'] == source) & self.recorded['Clean Name'].isin(new_entries['Clean Name'])
+        self.recorded = pd.concat([self.recorded[~recorded_replaced], new_entries], ignore_index=True)
+        self.changed = True
+
+    def merge(self, entries):
+        """Apply entries another copy of the store recorded, e.g. in a worker process
+
+        The entries replace the ones stored for the same name and source, except manual ones.
+        The store only counts as changed when its content actually differs afterwards.
+        """
+        def keys(df):
+            return pd.MultiIndex.from_frame(df[MATCH_STORE_KEY])
+
+        manual = self.entries[self.entries['Method'] == MANUAL]
+        entries = entries[~keys(entries).isin(keys(manual))]
+        if entries.empty:
+            return
+        replaced = keys(self.entries).isin(keys(entries))
+        merged = pd.concat([self.entries[~replaced], entries], ignore_index=True)
+
+        def ordered(df):
+            return df.sort_values(MATCH_STORE_KEY, kind='stable')[MATCH_STORE_COLUMNS].reset_index(drop=True)
+
+        if not ordered(merged).equals(ordered(self.entries)):
+            self.entries = merged
+            self.changed = True
+
+    def save(self):
+        """Write the store if anything was recorded, sorted by source and name so refreshes give small diffs"""
+        if not self.changed:
+            return False
+        entries = self.entries.sort_values(['Ranking Source', 'Clean Name'], kind='stable')[MATCH_STORE_COLUMNS]
+        entries.to_csv(self.path, index=False)
+        self.changed = False
+        return True
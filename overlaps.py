@@ -0,0 +1,241 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from simplification import overlap_error_bounds
+
+# Zones are split into shards for parallel runs by the first of these elementary zone columns present
+SHARD_COLUMNS = ['SCHOOLDIST', 'BORO']
+
+
+def _overlapping_pairs(elem_geoms, middle_geoms):
+    """Positions and overlap geometry of the overlapping pairs, plus candidate and intersecting counts
+
+    Pairs come back in nested loop order (elementary position first, then middle position).
+    """
+    # Bounding-box candidates from an STRtree built over the middle zones
+    elem_idx, middle_idx = shapely.STRtree(middle_geoms).query(elem_geoms)
+
+    # Keep the nested loop order so downstream sorting stays identical
+    order = np.lexsort((middle_idx, elem_idx))
+    elem_idx = elem_idx[order]
+    middle_idx = middle_idx[order]
+
+    # Exact intersects test on the candidates only
+    intersecting = shapely.intersects(elem_geoms[elem_idx], middle_geoms[middle_idx])
+    elem_idx = elem_idx[intersecting]
+    middle_idx = middle_idx[intersecting]
+
+    # Exact overlap for the intersecting pairs, touching zones overlap with an area of 0
+    intersections = shapely.intersection(elem_geoms[elem_idx], middle_geoms[middle_idx])
+    positive = shapely.area(intersections) > 0
+    return elem_idx[positive], middle_idx[positive], intersections[positive], len(order), int(intersecting.sum())
+
+
+def _shard_overlaps(elem_wkb, elem_rows, middle_wkb, middle_rows):
+    """Worker side of a parallel run: overlapping pairs of one shard, as rows of the full frames"""
+    elem_idx, middle_idx, intersections, candidates, intersecting = _overlapping_pairs(
+        shapely.from_wkb(elem_wkb), shapely.from_wkb(middle_wkb)
+    )
+    return elem_rows[elem_idx], middle_rows[middle_idx], shapely.to_wkb(intersections), candidates, intersecting
+
+
+def _shards(elementary_zones, middle_geoms):
+    """Split the zones into per-district shards for the worker processes
+
+    Each shard owns the elementary zones of one district, so every pair is computed exactly once.
+    Its middle zones are the halo of zones whose bounding box touches one of those elementary
+    zones, including zones of neighbouring districts that reach across the border, which is
+    every middle zone the district's elementary zones can possibly overlap.
+    """
+    elem_geoms = elementary_zones.geometry.values
+    middle_tree = shapely.STRtree(middle_geoms)
+    shard_column = next(column for column in SHARD_COLUMNS if column in elementary_zones.columns)
+    districts = pd.factorize(elementary_zones[shard_column], use_na_sentinel=False)[0]
+
+    shards = []
+    for district in np.unique(districts):
+        elem_rows = np.flatnonzero(districts == district)
+        middle_rows = np.unique(middle_tree.query(elem_geoms[elem_rows])[1])
+        shards.append((
+            shapely.to_wkb(elem_geoms[elem_rows]),
+            elem_rows,
+            shapely.to_wkb(middle_geoms[middle_rows]),
+            middle_rows,
+        ))
+    # Biggest shards first so a large district doesn't start last and hold up the pool
+    shards.sort(key=lambda shard: len(shard[1]) * len(shard[3]), reverse=True)
+    return shards
+
+
+def find_zone_overlaps(elementary_zones, middle_zones, workers=1, error_distance=None):
+    """Find elementary/middle zone pairs that overlap, using a spatial index to prune pairs.
+
+    Candidate pairs come from an STRtree bounding-box query, exact intersects/intersection
+    is only run on those candidates. Pairs are returned in the same order as the nested
+    loop over both frames would produce them (elementary row first, then middle row).
+
+    With more than one worker, the zones are sharded by school district and the shards run in
+    a process pool, geometry is sent to the workers as WKB. Pairs are merged back into nested
+    loop order, so the result is the same as a single process run.
+
+    error_distance is how far the zone boundaries may be from the real ones, for simplified
+    zones. Each pair then gets an Overlap_Error_Bound on its area, and pairs whose whole overlap
+    is within that bound are flagged as slivers.
+    """
+    elem_geoms = elementary_zones.geometry.values
+    middle_geoms = middle_zones.geometry.values
+
+    if workers > 1:
+        shards = _shards(elementary_zones, middle_geoms)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_shard_overlaps, *zip(*shards)))
+
+        elem_idx = np.concatenate([result[0] for result in results])
+        middle_idx = np.concatenate([result[1] for result in results])
+        intersections = shapely.from_wkb(np.concatenate([result[2] for result in results]))
+        candidate_pairs = sum(result[3] for result in results)
+        intersecting_pairs = sum(result[4] for result in results)
+
+        # Merge back into nested loop order, a pair can only come from its elementary zone's shard
+        order = np.lexsort((middle_idx, elem_idx))
+        elem_idx, middle_idx, intersections = elem_idx[order], middle_idx[order], intersections[order]
+        print(f"Computed overlaps for {len(shards)} district shards on {workers} worker processes")
+    else:
+        elem_idx, middle_idx, intersections, candidate_pairs, intersecting_pairs = _overlapping_pairs(elem_geoms, middle_geoms)
+
+    overlaps_df = pd.DataFrame({
+        'Elementary_DBN': elementary_zones['DBN'].values[elem_idx],
+        'Middle_K8_DBN': middle_zones['DBN'].values[middle_idx],
+        'Overlap_Area': shapely.area(intersections),
+        # Kept so later steps can build on the overlap without intersecting the zones again
+        'Overlap_Geometry': intersections,
+    })
+    if error_distance is not None:
+        overlaps_df['Overlap_Error_Bound'] = overlap_error_bounds(intersections, error_distance)
+        overlaps_df['Sliver'] = overlaps_df['Overlap_Area'] <= overlaps_df['Overlap_Error_Bound']
+
+    stats = {
+        'total_pairs': len(elementary_zones) * len(middle_zones),
+        'candidate_pairs': candidate_pairs,
+        'intersecting_pairs': intersecting_pairs,
+        'overlapping_pairs': len(overlaps_df),
+    }
+    stats['pruned_pairs'] = stats['total_pairs'] - stats['candidate_pairs']
+    if error_distance is not None:
+        stats['sliver_pairs'] = int(overlaps_df['Sliver'].sum())
+    return overlaps_df, stats
+
+
+def geometry_hashes(geometries):
+    """Hash of each geometry's WKB, identical geometry gives the same hash"""
+    return np.array([hashlib.sha256(wkb).hexdigest() for wkb in shapely.to_wkb(geometries)], dtype=object)
+
+
+def find_zone_overlaps_incremental(elementary_zones, middle_zones, previous=None):
+    """find_zone_overlaps that reuses the pairs of zones whose geometry hasn't changed
+
+    previous is the state returned by the last call, for the zones of another snapshot.
+    Pairs between zones whose geometry hash appears in previous are taken from it, overlaps
+    are only computed for pairs involving a new or changed zone. The result is the same as
+    find_zone_overlaps, with the state to pass to the next call.
+    """
+    elem_geoms = elementary_zones.geometry.values
+    middle_geoms = middle_zones.geometry.values
+    elem_hashes = geometry_hashes(elem_geoms)
+    middle_hashes = geometry_hashes(middle_geoms)
+
+    if previous is None:
+        previous = {'elementary': set(), 'middle': set(), 'pairs': {}}
+    known_elem = np.isin(elem_hashes, list(previous['elementary']))
+    known_middle = np.isin(middle_hashes, list(previous['middle']))
+
+    # New elementary zones against every middle zone, then known elementary zones against new middle zones
+    new_elem_rows = np.flatnonzero(~known_elem)
+    old_elem_rows = np.flatnonzero(known_elem)
+    new_middle_rows = np.flatnonzero(~known_middle)
+    elem_idx_new, middle_idx_new, intersections_new, candidates_new, _ = _overlapping_pairs(elem_geoms[new_elem_rows], middle_geoms)
+    elem_idx_old, middle_idx_old, intersections_old, candidates_old, _ = _overlapping_pairs(
+        elem_geoms[old_elem_rows], middle_geoms[new_middle_rows]
+    )
+
+    # Pairs between known zones come from the previous results
+    middle_rows_by_hash = {}
+    for row in np.flatnonzero(known_middle):
+        middle_rows_by_hash.setdefault(middle_hashes[row], []).append(row)
+    reused_elem, reused_middle, reused_intersections = [], [], []
+    for elem_row in old_elem_rows:
+        for middle_hash, intersection in previous['pairs'].get(elem_hashes[elem_row], {}).items():
+            for middle_row in middle_rows_by_hash.get(middle_hash, []):
+                reused_elem.append(elem_row)
+                reused_middle.append(middle_row)
+                reused_intersections.append(intersection)
+
+    elem_idx = np.concatenate([new_elem_rows[elem_idx_new], old_elem_rows[elem_idx_old], np.array(reused_elem, dtype=np.int64)])
+    middle_idx = np.concatenate([middle_idx_new, new_middle_rows[middle_idx_old], np.array(reused_middle, dtype=np.int64)])
+    intersections = np.concatenate([intersections_new, intersections_old, np.array(reused_intersections, dtype=object)])
+
+    # Back into nested loop order, as find_zone_overlaps returns them
+    order = np.lexsort((middle_idx, elem_idx))
+    elem_idx, middle_idx, intersections = elem_idx[order], middle_idx[order], intersections[order]
+
+    overlaps_df = pd.DataFrame({
+        'Elementary_DBN': elementary_zones['DBN'].values[elem_idx],
+        'Middle_K8_DBN': middle_zones['DBN'].values[middle_idx],
+        'Overlap_Area': shapely.area(intersections),
+        'Overlap_Geometry': intersections,
+    })
+
+    state = {'elementary': set(elem_hashes), 'middle': set(middle_hashes), 'pairs': {}}
+    for elem_hash, middle_hash, intersection in zip(elem_hashes[elem_idx], middle_hashes[middle_idx], intersections):
+        state['pairs'].setdefault(elem_hash, {})[middle_hash] = intersection
+
+    stats = {
+        'new_elementary_zones': len(new_elem_rows),
+        'new_middle_zones': len(new_middle_rows),
+        'candidate_pairs': candidates_new + candidates_old,
+        'reused_pairs': len(reused_elem),
+        'overlapping_pairs': len(overlaps_df),
+    }
+    return overlaps_df, stats, state
+
+
+def find_zone_chains(overlaps_df, high_zones):
+    """Elementary/middle/high zone chains: the areas served by one zone of each level
+
+    The elementary/middle overlap geometries from find_zone_overlaps are indexed against the
+    high school zones, so the work grows with the number of chains rather than with the
+    product of the three zone counts. Chains come back in overlap order, then high zone order.
+    """
+    overlap_geoms = overlaps_df['Overlap_Geometry'].to_numpy()
+    high_geoms = high_zones.geometry.values
+
+    # Bounding-box candidates from an STRtree built over the high school zones
+    overlap_idx, high_idx = shapely.STRtree(high_geoms).query(overlap_geoms)
+    order = np.lexsort((high_idx, overlap_idx))
+    overlap_idx = overlap_idx[order]
+    high_idx = high_idx[order]
+
+    intersecting = shapely.intersects(overlap_geoms[overlap_idx], high_geoms[high_idx])
+    overlap_idx = overlap_idx[intersecting]
+    high_idx = high_idx[intersecting]
+
+    areas = shapely.area(shapely.intersection(overlap_geoms[overlap_idx], high_geoms[high_idx]))
+    positive = areas > 0
+
+    chains_df = pd.DataFrame({
+        'Elementary_DBN': overlaps_df['Elementary_DBN'].to_numpy()[overlap_idx[positive]],
+        'Middle_K8_DBN': overlaps_df['Middle_K8_DBN'].to_numpy()[overlap_idx[positive]],
+        'High_DBN': high_zones['DBN'].to_numpy()[high_idx[positive]],
+        'Chain_Area': areas[positive],
+    })
+
+    stats = {
+        'overlap_pairs': len(overlaps_df),
+        'candidate_triples': len(order),
+        'chains': len(chains_df),
+    }
+    return chains_df, stats
@@ -0,0 +1,259 @@
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+
+import pandas as pd
+
+# Stage outputs are cached here, keyed by a hash of everything the stage read
+STAGE_CACHE_DIR = os.path.join('.cache', 'stages')
+
+# Registered stages by name, in registration order
+STAGES = {}
+
+_file_hashes = {}
+
+
+def file_hash(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cached_file_hash(path):
+    """file_hash memoized for the current process, keyed by path and modification time
+
+    A file that doesn't exist yet, like a store a stage creates on its first run, hashes to None.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _file_hashes:
+        _file_hashes[memo_key] = file_hash(path)
+    return _file_hashes[memo_key]
+
+
+def _code_source(code):
+    """Source of a helper function, or of a local helper module read without importing it"""
+    if callable(code):
+        return inspect.getsource(code)
+    spec = importlib.util.find_spec(code)
+    with open(spec.origin, encoding='utf-8') as f:
+        return f.read()
+
+
+def stage(name, inputs=(), files=(), state=(), outputs=(), code=(), params=(), options=(), version=1):
+    """Register a function as a pipeline stage
+
+    inputs are names of upstream stages, passed to the function as keyword arguments.
+    params are names of run settings, also passed as keyword arguments and part of the cache
+    key, the function's default is used when a run doesn't set one. options are run settings
+    that don't change the result, like a worker count. They are passed the same way but left
+    out of the cache key.
+    files are the source files the stage reads, outputs the files it writes. state files are
+    read and updated by the stage, like a store of earlier results. They are part of the key as
+    they are after the run, so the stage's own update doesn't make the next run miss. code lists
+    helper functions and local helper module names whose source is part of the cache key,
+    next to the function's own source. Bump version to invalidate cached outputs for any other reason.
+    """
+    def register(func):
+        STAGES[name] = {
+            'name': name,
+            'func': func,
+            'inputs': list(inputs),
+            'files': list(files),
+            'state': list(state),
+            'outputs': list(outputs),
+            'code': list(code),
+            'params': list(params),
+            'options': list(options),
+            'version': version,
+        }
+        return func
+    return register
+
+
+def stage_order(targets):
+    """Stages needed for targets, each listed after all of its inputs"""
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        for dependency in STAGES[name]['inputs']:
+            visit(dependency)
+        order.append(name)
+
+    for target in targets:
+        visit(target)
+    return order
+
+
+def _downstream(name, order):
+    """name and every stage in order that depends on it, directly or not"""
+    affected = {name}
+    for candidate in order:
+        if any(dependency in affected for dependency in STAGES[candidate]['inputs']):
+            affected.add(candidate)
+    return affected
+
+
+def _stage_params(spec, params, kind='params'):
+    """Values of the stage's params (or options), from the run's values or the function's defaults"""
+    defaults = inspect.signature(spec['func']).parameters
+    return {name: params[name] if name in params else defaults[name].default for name in spec[kind]}
+
+
+def _stage_key(spec, digests, params):
+    """Cache key from the stage's code, params, source files and its inputs' output digests"""
+    key_parts = {
+        'name': spec['name'],
+        'version': spec['version'],
+        'source': inspect.getsource(spec['func']),
+        'code': [_code_source(code) for code in spec['code']],
+        'files': {path: _cached_file_hash(path) for path in spec['files'] + spec['state']},
+        'inputs': {dependency: digests[dependency] for dependency in spec['inputs']},
+        'params': params,
+    }
+    return hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _update_digest(digest, value):
+    """Feed a stage output's content into digest
+
+    Frames are hashed by their values rather than their pickle, which also depends on how
+    pandas laid out the blocks, so a rerun giving an equal frame gives the same digest.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = list(value.dtypes) if isinstance(value, pd.DataFrame) else [value.dtype]
+        digest.update(repr((type(value).__name__, columns, [str(dtype) for dtype in dtypes])).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode('utf-8'))
+            _update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)}".encode('utf-8'))
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, (set, frozenset)):
+        digest.update(repr(sorted(repr(item) for item in value)).encode('utf-8'))
+    else:
+        digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def output_digest(output):
+    """SHA-256 of a stage output's content"""
+    digest = hashlib.sha256()
+    _update_digest(digest, output)
+    return digest.hexdigest()
+
+
+def cached_key(name, cache_dir=STAGE_CACHE_DIR):
+    """Cache key of the stage's stored result, None when it has none"""
+    if not os.path.isdir(cache_dir):
+        return None
+    for cached_name in os.listdir(cache_dir):
+        stage_name, _, key = cached_name.rsplit('.', 1)[0].rpartition('-')
+        if stage_name == name and cached_name.endswith('.json'):
+            return key
+    return None
+
+
+def load_cached(name, key, cache_dir=STAGE_CACHE_DIR):
+    """Stored result of a stage for the given cache key, without running anything"""
+    with open(os.path.join(cache_dir, f"{name}-{key}.pkl"), 'rb') as f:
+        return pickle.load(f)
+
+
+def run_pipeline(targets=None, force=False, from_stage=None, cache_dir=STAGE_CACHE_DIR, profiler=None, params=None,
+                 options=None):
+    """Run the stages needed for targets, skipping the ones whose cached output is still valid
+
+    A stage is skipped when its cache key matches a stored result and all of its output files
+    exist. Because keys include the digest of each input's output, a stage that reruns but
+    produces the same result does not invalidate the stages after it.
+    force reruns everything, from_stage reruns that stage and everything downstream of it.
+    When a profiling.StageProfiler is given, every stage that runs is measured through it.
+    params maps setting names to values for the stages that declare them, options likewise
+    for settings that aren't part of the cache key.
+    Returns a dict of target name to stage output.
+    """
+    targets = list(targets or STAGES)
+    params = params or {}
+    options = options or {}
+    order = stage_order(targets)
+    if from_stage and from_stage not in order:
+        raise ValueError(f"Stage '{from_stage}' isn't run for {', '.join(targets)}, stages run: {', '.join(order)}")
+
+    if force:
+        forced = set(order)
+    elif from_stage:
+        forced = _downstream(from_stage, order)
+    else:
+        forced = set()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = {}
+    digests = {}
+    results = {}
+
+    def result(name):
+        # Outputs of skipped stages are only unpickled when something actually needs them
+        if name not in results:
+            with open(os.path.join(cache_dir, f"{name}-{keys[name]}.pkl"), 'rb') as f:
+                results[name] = pickle.load(f)
+        return results[name]
+
+    for name in order:
+        spec = STAGES[name]
+        stage_params = _stage_params(spec, params)
+        keys[name] = _stage_key(spec, digests, stage_params)
+        data_path = os.path.join(cache_dir, f"{name}-{keys[name]}.pkl")
+        meta_path = os.path.join(cache_dir, f"{name}-{keys[name]}.json")
+
+        if (name not in forced and os.path.exists(data_path) and os.path.exists(meta_path)
+                and all(os.path.exists(path) for path in spec['outputs'])):
+            with open(meta_path, encoding='utf-8') as f:
+                digests[name] = json.load(f)['digest']
+            print(f"Skipping stage '{name}' (inputs unchanged)")
+            if profiler is not None:
+                profiler.skipped(name)
+            continue
+
+        print(f"\nRunning stage '{name}'")
+        inputs = {dependency: result(dependency) for dependency in spec['inputs']}
+        inputs.update(stage_params)
+        inputs.update(_stage_params(spec, options, kind='options'))
+        if profiler is not None:
+            output = profiler.run(name, spec['func'], inputs)
+        else:
+            output = spec['func'](**inputs)
+
+        data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+        digests[name] = output_digest(output)
+        results[name] = output
+
+        # Store the result under the key of the state files as the stage left them
+        if spec['state']:
+            keys[name] = _stage_key(spec, digests, stage_params)
+            data_path = os.path.join(cache_dir, f"{name}-{keys[name]}.pkl")
+            meta_path = os.path.join(cache_dir, f"{name}-{keys[name]}.json")
+
+        # Replace older cached results of this stage
+        for cached_name in os.listdir(cache_dir):
+            if cached_name.rsplit('.', 1)[0].rsplit('-', 1)[0] == name:
+                os.remove(os.path.join(cache_dir, cached_name))
+        with open(data_path, 'wb') as f:
+            f.write(data)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'stage': name, 'key': keys[name], 'digest': digests[name]}, f)
+
+    return {name: result(name) for name in targets}
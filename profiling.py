@@ -0,0 +1,125 @@
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is reported as null there
+    resource = None
+
+# Default location of the --profile report
+PROFILE_REPORT_FILE = 'profile_report.json'
+
+# Counters of the stage currently being profiled, None when profiling is off
+_active_counters = None
+
+
+def count(name, value):
+    """Add value to a named counter of the stage being profiled, no-op when profiling is off"""
+    if _active_counters is not None:
+        _active_counters[name] = _active_counters.get(name, 0) + int(value)
+
+
+def row_count(value):
+    """Rows in a stage input or output: frame length, or the sum over a dict of frames"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        counts = [row_count(item) for item in value.values()]
+        counts = [rows for rows in counts if rows is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageProfiler:
+    """Records wall time, CPU time, memory, row counts and stage counters for each pipeline stage"""
+
+    def __init__(self, cprofile=False):
+        self.cprofile = cprofile
+        self.stages = []
+        self._profiles = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def run(self, name, func, inputs):
+        """Run one stage function with its inputs and record its measurements"""
+        global _active_counters
+        counters = {}
+        profile = cProfile.Profile() if self.cprofile else None
+
+        tracemalloc.reset_peak()
+        _active_counters = counters
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            if profile is not None:
+                output = profile.runcall(func, **inputs)
+            else:
+                output = func(**inputs)
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            _active_counters = None
+
+        self.stages.append({
+            'stage': name,
+            'cached': False,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': cpu_seconds,
+            'peak_traced_mb': tracemalloc.get_traced_memory()[1] / (1024 * 1024),
+            # Peak RSS is for the whole process so far, not just this stage
+            'peak_rss_mb': _peak_rss_mb(),
+            'rows_in': {input_name: row_count(value) for input_name, value in inputs.items()},
+            'rows_out': row_count(output),
+            'counters': counters,
+        })
+        if profile is not None:
+            self._profiles[name] = profile
+        return output
+
+    def skipped(self, name):
+        """Record a stage whose cached result was reused"""
+        self.stages.append({'stage': name, 'cached': True})
+
+    def write_report(self, path=PROFILE_REPORT_FILE):
+        """Save the JSON report, print the summary table to stderr and dump the slowest stage's cProfile"""
+        ran = [entry for entry in self.stages if not entry['cached']]
+        report = {'stages': self.stages, 'total_wall_seconds': sum(entry['wall_seconds'] for entry in ran)}
+
+        if self._profiles and ran:
+            slowest = max(ran, key=lambda entry: entry['wall_seconds'])['stage']
+            profile_path = f"{path.rsplit('.', 1)[0]}_{slowest}.prof"
+            self._profiles[slowest].dump_stats(profile_path)
+            report['cprofile'] = {'stage': slowest, 'path': profile_path}
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        print(f"\n{'stage':<16}{'wall s':>9}{'cpu s':>9}{'peak MB':>9}{'rss MB':>9}{'rows in':>9}{'rows out':>9}  counters", file=sys.stderr)
+        for entry in self.stages:
+            if entry['cached']:
+                print(f"{entry['stage']:<16}{'cached':>9}", file=sys.stderr)
+                continue
+            rows_in = sum(rows for rows in entry['rows_in'].values() if rows is not None)
+            rows_out = entry['rows_out'] if entry['rows_out'] is not None else '-'
+            peak_rss = f"{entry['peak_rss_mb']:.1f}" if entry['peak_rss_mb'] is not None else '-'
+            counters = ', '.join(f"{name}={value}" for name, value in entry['counters'].items())
+            print(f"{entry['stage']:<16}{entry['wall_seconds']:>9.3f}{entry['cpu_seconds']:>9.3f}"
+                  f"{entry['peak_traced_mb']:>9.1f}{peak_rss:>9}{rows_in:>9}{rows_out:>9}  {counters}",
+                  file=sys.stderr)
+        print(f"Profile report saved to {path}", file=sys.stderr)
+        if 'cprofile' in report:
+            print(f"cProfile of slowest stage '{report['cprofile']['stage']}' saved to {report['cprofile']['path']}", file=sys.stderr)
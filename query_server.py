@@ -0,0 +1,361 @@
+import argparse
+import functools
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from pipeline import cached_key, load_cached, run_pipeline
+
+# Stage outputs the server keeps in memory, reloaded together when any of them changes
+SERVED_STAGES = ['overlap_report', 'school_table', 'unzoned', 'zones']
+
+# Filtered views kept serialized, per loaded data set
+VIEW_CACHE_SIZE = 1024
+
+DEFAULT_PORT = 8765
+DEFAULT_TOP = 20
+
+
+def _records(df):
+    """JSON text of each row, serialized once so views only join them"""
+    return [json.dumps(record) for record in json.loads(df.to_json(orient='records'))]
+
+
+def _count(value):
+    """Non-negative integer query value, ValueError otherwise"""
+    if not value.isdigit():
+        raise ValueError(f"expected a non-negative integer, got {value!r}")
+    return int(value)
+
+
+def _number(value):
+    """Finite number query value, ValueError otherwise"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"expected a finite number, got {value!r}")
+    return number
+
+
+def _json_list(items):
+    return ('[' + ','.join(items) + ']').encode('utf-8')
+
+
+def _positions_by(values):
+    """Row positions for each distinct value, in row order"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    order = np.argsort(codes, kind='stable')
+    groups = np.split(order, np.flatnonzero(np.diff(codes[order])) + 1) if len(order) else []
+    return {uniques[codes[group[0]]]: group for group in groups if codes[group[0]] >= 0}
+
+
+class QueryIndex:
+    """The pipeline's outputs held in memory with indexes for the server's queries
+
+    Pairs stay in report order, best average rank first, so a top-N view is the first N
+    positions of an index. Every filtered view is cached as the JSON bytes of its response.
+    """
+
+    def __init__(self, overlap_report, school_table, unzoned, zones, keys=None):
+        from script import numeric_ranks, school_details
+        from zone_lookup import ZoneLookup
+
+        self.keys = keys
+        self.loaded_at = time.time()
+
+        # Average rank per pair, the report's sort order, inf when either school is unranked
+        elem_rank = numeric_ranks(overlap_report['Elementary_SchoolDigger_Rank'])
+        middle_rank = numeric_ranks(overlap_report['Middle_SchoolDigger_Rank'])
+        self.average_rank = ((elem_rank + middle_rank) / 2).fillna(float('inf')).to_numpy()
+        self.pairs = _records(overlap_report.assign(
+            Average_Rank=np.where(np.isinf(self.average_rank), np.nan, self.average_rank)
+        ))
+        self.pair_count = len(self.pairs)
+
+        # Pairs by DBN on either side, by borough on either side and by school type on either side
+        dbns = np.concatenate([overlap_report['Elementary_DBN'].to_numpy(dtype=object), overlap_report['Middle_K8_DBN'].to_numpy(dtype=object)])
+        boroughs = np.concatenate([overlap_report['Elementary_Borough'].to_numpy(dtype=object), overlap_report['Middle_Borough'].to_numpy(dtype=object)])
+        types = np.concatenate([overlap_report['Elementary_School_Type'].astype(object).to_numpy(), overlap_report['Middle_School_Type'].astype(object).to_numpy()])
+        rows = np.tile(np.arange(self.pair_count), 2)
+        self.pairs_by_dbn = {dbn: np.unique(rows[group]) for dbn, group in _positions_by(dbns).items()}
+        self.pairs_by_borough = {str(borough).lower(): np.unique(rows[group]) for borough, group in _positions_by(boroughs).items()}
+        self.pairs_by_type = {str(school_type).lower(): np.unique(rows[group]) for school_type, group in _positions_by(types).items()}
+
+        schools = school_details(school_table)
+        self.schools = dict(zip(schools.index, _records(schools.reset_index())))
+
+        unzoned_records = np.array(_records(unzoned), dtype=object)
+        self.unzoned = {str(borough).lower(): list(unzoned_records[group])
+                        for borough, group in _positions_by(unzoned['Borough'].to_numpy(dtype=object)).items()}
+        self.unzoned_all = list(unzoned_records)
+
+        self.zone_lookup = ZoneLookup(
+            {'Elementary': zones['elementary'], 'Middle': zones['middle'], 'High': zones['high']}, school_table
+        )
+        self.view = functools.lru_cache(maxsize=VIEW_CACHE_SIZE)(self._view)
+
+    def _view(self, kind, *args):
+        """JSON bytes of a filtered view, called through the LRU cached self.view"""
+        if kind == 'top_pairs':
+            return self._top_pairs(*args)
+        if kind == 'dbn_pairs':
+            positions = self.pairs_by_dbn.get(args[0], [])
+            return _json_list(self.pairs[position] for position in positions)
+        if kind == 'unzoned':
+            borough = args[0]
+            return _json_list(self.unzoned_all if borough is None else self.unzoned.get(borough, []))
+        raise ValueError(f"Unknown view {kind}")
+
+    def _top_pairs(self, top, borough, school_type, max_rank):
+        # Pairs at or under the rank threshold are a prefix of the report
+        end = self.pair_count if max_rank is None else int(np.searchsorted(self.average_rank, max_rank, side='right'))
+        positions = np.arange(end)
+        if borough is not None:
+            positions = np.intersect1d(positions, self.pairs_by_borough.get(borough, []), assume_unique=True)
+        if school_type is not None:
+            positions = np.intersect1d(positions, self.pairs_by_type.get(school_type, []), assume_unique=True)
+        return _json_list(self.pairs[position] for position in positions[:top])
+
+    def top_pairs(self, top=DEFAULT_TOP, borough=None, school_type=None, max_rank=None):
+        if top < 0:
+            raise ValueError(f"top must not be negative, got {top}")
+        return self.view('top_pairs', top, borough and borough.lower(), school_type and school_type.lower(), max_rank)
+
+    def dbn_pairs(self, dbn):
+        return self.view('dbn_pairs', dbn.upper())
+
+    def unzoned_schools(self, borough=None):
+        return self.view('unzoned', borough and borough.lower())
+
+    def school(self, dbn):
+        record = self.schools.get(dbn.upper())
+        return None if record is None else record.encode('utf-8')
+
+    def zoned_schools(self, lon, lat):
+        """Zoned schools serving one point, looked up in the zone index"""
+        found = self.zone_lookup.lookup([lon], [lat])
+        return found.iloc[0:1].to_json(orient='records')[1:-1].encode('utf-8')
+
+    def status(self):
+        cache = self.view.cache_info()
+        return json.dumps({
+            'keys': self.keys,
+            'loaded_at': self.loaded_at,
+            'pairs': self.pair_count,
+            'schools': len(self.schools),
+            'unzoned': len(self.unzoned_all),
+            'view_cache': {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize},
+        }).encode('utf-8')
+
+
+def stage_keys():
+    """Cache keys of the served stages' current results, None when one is missing"""
+    keys = {name: cached_key(name) for name in SERVED_STAGES}
+    return None if None in keys.values() else keys
+
+
+def load_index(keys):
+    """QueryIndex over the stored results for keys, nothing is recomputed"""
+    return QueryIndex(**{name: load_cached(name, key) for name, key in keys.items()}, keys=keys)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the current QueryIndex, swapped whole on reload"""
+
+    daemon_threads = True
+    # Room for many clients connecting at once
+    request_queue_size = 128
+
+    def __init__(self, address, index):
+        super().__init__(address, QueryHandler)
+        self.index = index
+
+    def watch(self, interval):
+        """Reload the index in a background thread whenever a served stage's result changes"""
+        def poll():
+            while True:
+                time.sleep(interval)
+                keys = stage_keys()
+                if keys is None or keys == self.index.keys:
+                    continue
+                start = time.perf_counter()
+                try:
+                    index = load_index(keys)
+                except FileNotFoundError:
+                    # A pipeline run is replacing the results, try again on the next poll
+                    continue
+                changed = [name for name in SERVED_STAGES if keys[name] != self.index.keys[name]]
+                self.index = index
+                print(f"Reloaded {', '.join(changed) or 'stage outputs'} in {time.perf_counter() - start:.2f}s")
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return thread
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Routes GET requests to the server's current QueryIndex
+
+    /pairs?top=N&borough=B&type=T&max_rank=R  top pairs by average rank
+    /pairs/<DBN>                               pairs either school of which is DBN
+    /schools/<DBN>                             one school's details
+    /unzoned?borough=B                         unzoned schools
+    /zones?lon=X&lat=Y                         zoned schools serving a point
+    /status                                    loaded keys and view cache counters
+    """
+
+    # Keep-alive, clients reuse their connection between queries. Headers and body go out as
+    # separate writes, with Nagle's algorithm the body would wait for the client's delayed ACK.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        index = self.server.index
+        try:
+            if parts == ['pairs']:
+                body = index.top_pairs(
+                    top=_count(query['top']) if 'top' in query else DEFAULT_TOP,
+                    borough=query.get('borough'),
+                    school_type=query.get('type'),
+                    max_rank=_number(query['max_rank']) if 'max_rank' in query else None,
+                )
+            elif len(parts) == 2 and parts[0] == 'pairs':
+                body = index.dbn_pairs(parts[1])
+            elif len(parts) == 2 and parts[0] == 'schools':
+                body = index.school(parts[1])
+            elif parts == ['unzoned']:
+                body = index.unzoned_schools(query.get('borough'))
+            elif parts == ['zones']:
+                body = index.zoned_schools(_number(query['lon']), _number(query['lat']))
+            elif parts == ['status']:
+                body = index.status()
+            else:
+                body = None
+        except (KeyError, ValueError) as error:
+            return self._send(400, json.dumps({'error': f"Bad query: {error}"}).encode('utf-8'))
+
+        if body is None:
+            return self._send(404, json.dumps({'error': f"Not found: {url.path}"}).encode('utf-8'))
+        self._send(200, body)
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per request logging would dominate the latency of cached views
+        pass
+
+
+def _percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, math.ceil(fraction * len(latencies)) - 1)]
+
+
+def load_test(server, requests, clients, seed=0):
+    """Latency of a mix of queries sent by concurrent keep-alive clients, in milliseconds"""
+    index = server.index
+    rng = random.Random(seed)
+    dbns = list(index.pairs_by_dbn)
+    boroughs = list(index.unzoned)
+    paths = []
+    boroughs = [quote(borough) for borough in boroughs]
+    for _ in range(requests):
+        choice = rng.random()
+        if choice < 0.4:
+            paths.append(f"/pairs?top={rng.choice([10, 20, 50])}&borough={rng.choice(boroughs)}")
+        elif choice < 0.5:
+            paths.append(f"/pairs?max_rank={rng.randint(50, 1500)}&type=k-8")
+        elif choice < 0.8:
+            paths.append(f"/pairs/{rng.choice(dbns)}")
+        elif choice < 0.9:
+            paths.append(f"/schools/{rng.choice(dbns)}")
+        else:
+            paths.append(f"/unzoned?borough={rng.choice(boroughs)}")
+
+    host, port = server.server_address[:2]
+    latencies = []
+
+    def client(client_paths):
+        connection = http.client.HTTPConnection(host, port)
+        for path in client_paths:
+            start = time.perf_counter()
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - start) * 1000)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(paths[offset::clients],)) for offset in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / seconds,
+        'p50_ms': _percentile(latencies, 0.5),
+        'p99_ms': _percentile(latencies, 0.99),
+        'max_ms': latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve queries over the processed school data from memory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--poll', type=float, default=2.0, metavar='SECONDS',
+                        help='how often to check the stage cache for new results to reload')
+    parser.add_argument('--load-test', type=int, metavar='REQUESTS',
+                        help='serve on a free port, send this many queries from --clients threads and report latency')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients for --load-test')
+    args = parser.parse_args()
+
+    # Bring the stage results up to date once, later runs of script.py are picked up by the watcher
+    # Only the stages whose inputs changed since the last run are executed
+    import script  # noqa: F401 registers the pipeline stages
+    run_pipeline(['overlap_report', 'unzoned'])
+    keys = stage_keys()
+
+    start = time.perf_counter()
+    server = QueryServer((args.host, 0 if args.load_test else args.port), load_index(keys))
+    print(f"Loaded {server.index.pair_count} pairs, {len(server.index.schools)} schools and "
+          f"{len(server.index.unzoned_all)} unzoned schools in {time.perf_counter() - start:.2f}s")
+
+    if args.load_test:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        result = load_test(server, args.load_test, args.clients)
+        server.shutdown()
+        print(f"{result['requests']} queries from {args.clients} clients, {result['requests_per_second']:,.0f} queries/s: "
+              f"p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms")
+        cache = server.index.view.cache_info()
+        print(f"View cache: {cache.hits} hits, {cache.misses} misses")
+        return
+
+    server.watch(args.poll)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Ordered replacement rules applied to lower-cased school names.
+# Rules run in sequence, so earlier rules feed later ones (e.g. 'junior high school ' -> 'jhs ' -> 'jhs 0' -> 'jhs ').
+REPLACEMENTS = [
+    # Specific school name mappings for edge cases
+    ('academy for collaborative exploration', 'institute for collaborative education'),
+    ('kathleen grimm school for leadership and sustainability', 'kathleen grimm school for leadership'),
+    ('ps 166 richard rodgers', 'ps 166 richard rogers'),  # Rodgers vs Rogers spelling
+    ('ps is 173 fort washington in heights', 'ps 173'),
+    ('ps/ms 200 magnet of global studies and leadership', 'ps/ms 200 magnet global studi'),
+    ('ps 80 the thurgood marshall magnet school of multimedia and communication', 'ps 80 thurgood marshall magnet school of multimedia'),
+    ('junior high school ', 'jhs '),
+    ('j.h.s. ', 'jhs '),
+    ('jhs ', 'jhs '),  # keep this to standardize after other replacements
+    ('middle school ', 'ms '),  # Add space to avoid partial matches
+    ('m.s. ', 'ms '),
+    ('p.s./i.s.', 'ps is'),  # Add this to handle combined PS/IS format
+    ('ps/is', 'ps is'),      # Add this to handle combined format without periods
+    ('p.s.', 'ps'),
+    ('m.s.', 'ms'),
+    ('i.s.', 'is'),
+    ('the ', ''),            # Remove 'the' at start
+    ('(the)', ''),
+    (' (the)', ''),
+    (' the ', ' '),         # Remove 'the' in middle
+    ('elementary school', ''),
+    ('secondary school', ''),
+    ('high school', ''),
+    ('middle school', 'ms'),
+    (' school', ''),
+    (' hs', ''),
+    (' ms', ''),
+    (' es', ''),
+    ('ps 00', 'ps '),  # handle double leading zeros
+    ('ms 00', 'ms '),
+    ('is 00', 'is '),
+    ('jhs 00', 'jhs '),
+    ('ps 0', 'ps '),   # handle single leading zero
+    ('ms 0', 'ms '),
+    ('is 0', 'is '),
+    ('jhs 0', 'jhs '),
+    (' - ', ' '),
+    ('-', ' '),
+    (':', ''),
+    ('.', ''),
+    (',', ''),
+    ('  ', ' '),  # Remove double spaces
+    ('elementary school', ''),
+    ('secondary school', ''),
+    ('high school', ''),
+    ('sciencetech', 'science technology'),
+    ('Garnett', 'Garnet'),
+    ('ms 419', 'ps 419'),
+]
+
+# Remove borough codes from end of numbers (e.g. 184m -> 184)
+BOROUGH_CODE_PATTERN = re.compile(r'(\d+)[kxmqr]')
+
+# Borough names stripped from the end of the school name, in order
+# This handles cases like "P.S. 089 Bronx" -> "ps 89"
+BOROUGH_NAMES = ['manhattan', 'bronx', 'brooklyn', 'queens', 'staten island', 'staten is', 'jackson heights']
+
+_BOROUGH_SUFFIXES = tuple(BOROUGH_NAMES)
+
+# Final post-processing mappings for specific edge cases
+# These are applied AFTER all other transformations
+FINAL_MAPPINGS = {
+    'ps is 173 fort washington in heights': 'ps 173',
+    'ps/ms 200 magnet of global studies and leadership': 'ps/ms 200 magnet global studi',
+    'ps 166 richard rodgers of arts and technology': 'ps 166 richard rogers of arts & science',
+}
+
+# Separator used to join a batch of names into one buffer.
+# No rule above can match across it, so each rule can run once over the whole batch.
+_BATCH_SEPARATOR = '\x00'
+
+
+def _finish_name(name):
+    """Strip trailing borough names and apply the final mappings to a replaced name"""
+    if not name.endswith(_BOROUGH_SUFFIXES):
+        name = name.strip()
+        return FINAL_MAPPINGS.get(name, name)
+
+    for borough in BOROUGH_NAMES:
+        # Remove borough name if it appears at the end (with optional leading space)
+        if name.endswith(' ' + borough):
+            name = name[:-len(' ' + borough)]
+        elif name.endswith(borough):
+            name = name[:-len(borough)]
+
+    name = name.strip()
+    return FINAL_MAPPINGS.get(name, name)
+
+
+def _replace_all(text):
+    """Run the ordered replacement rules and the borough code regex over text"""
+    for old, new in REPLACEMENTS:
+        text = text.replace(old, new)
+    return BOROUGH_CODE_PATTERN.sub(r'\1', text)
+
+
+def clean_school_name(name):
+    """Standardize school name for matching by removing common variations and special characters"""
+    if pd.isna(name):
+        return ''
+    return _finish_name(_replace_all(str(name).lower()))
+
+
+def clean_school_names(names):
+    """Standardize a Series of school names, giving the same result as clean_school_name on each row.
+
+    Repeated names are normalized once. The unique names are joined into a single buffer so
+    every replacement rule is one C-level pass over the whole batch instead of one call per row.
+    """
+    codes, uniques = pd.factorize(names)
+    unique_names = [str(name) for name in uniques]
+
+    buffer = _BATCH_SEPARATOR.join(unique_names)
+    if not unique_names:
+        replaced = []
+    elif buffer.count(_BATCH_SEPARATOR) == len(unique_names) - 1:
+        replaced = _replace_all(buffer.lower()).split(_BATCH_SEPARATOR)
+    else:
+        # A name contains the separator itself, fall back to one name at a time
+        replaced = [_replace_all(name.lower()) for name in unique_names]
+
+    # Missing names (code -1) map to the trailing empty string
+    cleaned = [_finish_name(name) for name in replaced]
+    cleaned.append('')
+    values = np.array(cleaned, dtype=object)[codes]
+    return pd.Series(values, index=names.index, name=names.name)
@@ -1,215 +1,187 @@
+import argparse
+import sys
+
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.wkt import loads
-import difflib
-import re
-
-def clean_school_name(name):
-    """Standardize school name for matching by removing common variations and special characters"""
-    if pd.isna(name):
-        return ''
-    name = str(name).lower()
-    # Remove common prefixes/suffixes and special characters
-    replacements = [
-        # Specific school name mappings for edge cases
-        ('academy for collaborative exploration', 'institute for collaborative education'),
-        ('kathleen grimm school for leadership and sustainability', 'kathleen grimm school for leadership'),
-        ('ps 166 richard rodgers', 'ps 166 richard rogers'),  # Rodgers vs Rogers spelling
-        ('ps is 173 fort washington in heights', 'ps 173'),
-        ('ps/ms 200 magnet of global studies and leadership', 'ps/ms 200 magnet global studi'),
-        ('ps 80 the thurgood marshall magnet school of multimedia and communication', 'ps 80 thurgood marshall magnet school of multimedia'),
-        ('junior high school ', 'jhs '),
-        ('j.h.s. ', 'jhs '),
-        ('jhs ', 'jhs '),  # keep this to standardize after other replacements
-        ('middle school ', 'ms '),  # Add space to avoid partial matches
-        ('m.s. ', 'ms '),
-        ('p.s./i.s.', 'ps is'),  # Add this to handle combined PS/IS format
-        ('ps/is', 'ps is'),      # Add this to handle combined format without periods
-        ('p.s.', 'ps'),
-        ('m.s.', 'ms'),
-        ('i.s.', 'is'),
-        ('the ', ''),            # Remove 'the' at start
-        ('(the)', ''),
-        (' (the)', ''),
-        (' the ', ' '),         # Remove 'the' in middle
-        ('elementary school', ''),
-        ('secondary school', ''),
-        ('high school', ''),
-        ('middle school', 'ms'),
-        (' school', ''),
-        (' hs', ''),
-        (' ms', ''),
-        (' es', ''),
-        ('ps 00', 'ps '),  # handle double leading zeros
-        ('ms 00', 'ms '),
-        ('is 00', 'is '),
-        ('jhs 00', 'jhs '),
-        ('ps 0', 'ps '),   # handle single leading zero
-        ('ms 0', 'ms '),
-        ('is 0', 'is '),
-        ('jhs 0', 'jhs '),
-        (' - ', ' '),
-        ('-', ' '),
-        (':', ''),
-        ('.', ''),
-        (',', ''),
-        ('  ', ' '),  # Remove double spaces
-        ('elementary school', ''),
-        ('secondary school', ''),
-        ('high school', ''),
-        ('sciencetech', 'science technology'),
-        ('Garnett', 'Garnet'),
-        ('ms 419', 'ps 419'),
-    ]
-    for old, new in replacements:
-        name = name.replace(old, new)
-    
-    # Remove borough codes from end of numbers (e.g. 184m -> 184)
-    name = re.sub(r'(\d+)[kxmqr]', r'\1', name)
-    
-    # Remove borough names from the end of the school name
-    # This handles cases like "P.S. 089 Bronx" -> "ps 89"
-    borough_names = ['manhattan', 'bronx', 'brooklyn', 'queens', 'staten island', 'staten is', 'jackson heights']
-    for borough in borough_names:
-        # Remove borough name if it appears at the end (with optional leading space)
-        if name.endswith(' ' + borough):
-            name = name[:-len(' ' + borough)]
-        elif name.endswith(borough):
-            name = name[:-len(borough)]
-    
-    name = name.strip()
-    
-    # Final post-processing mappings for specific edge cases
-    # These are applied AFTER all other transformations
-    final_mappings = {
-        'ps is 173 fort washington in heights': 'ps 173',
-        'ps/ms 200 magnet of global studies and leadership': 'ps/ms 200 magnet global studi',
-        'ps 166 richard rodgers of arts and technology': 'ps 166 richard rogers of arts & science',
+
+from fuzzy_matching import fuzzy_match_rankings
+from lcgms import load_lcgms
+from match_store import MATCH_STORE_FILE, MatchStore
+from pipeline import STAGES, run_pipeline, stage, stage_order
+from profiling import PROFILE_REPORT_FILE, StageProfiler, count
+from school_names import clean_school_names
+from site_export import SITE_DATA_DIR, SITE_MANIFEST_FILE, export_site_data
+
+# Input files
+LCGMS_FILE = 'GeneralSchoolData/LCGMS_SchoolData_20251130_1323.csv'
+ELEMENTARY_ZONES_FILE = 'ZoningData/School_Zones_2024-2025_(Elementary_School)_20251130.csv'
+MIDDLE_ZONES_FILE = 'ZoningData/School_Zones_2024-2025_(Middle_School)_20251130.csv'
+HIGH_ZONES_FILE = 'ZoningData/School_Zones_2024-2025_(High_School)_20251130.csv'
+ELEMENTARY_RANKINGS_FILE = 'RankingData/SchoolDigger/ElementarySchools.csv'
+MIDDLE_RANKINGS_FILE = 'RankingData/SchoolDigger/MiddleSchools.csv'
+HIGH_RANKINGS_FILE = 'RankingData/SchoolDigger/HighSchools.csv'
+
+# Output files
+OVERLAPS_OUTPUT_FILE = 'Elementary_Middle_School_Overlaps_Simplified.csv'
+UNZONED_OUTPUT_FILE = 'unzoned_schools.csv'
+CHAINS_OUTPUT_FILE = 'Elementary_Middle_High_School_Chains.csv'
+
+# Stages each subcommand runs. Geometry modules (geopandas, shapely) are imported inside the
+# stages that need them, so the commands that don't touch zone geometry never load them.
+COMMAND_TARGETS = {
+    'match': ['matching'],
+    'zones': ['zone_geometry'],
+    'overlaps': ['overlap_report', 'chains'],
+    'unzoned': ['unzoned'],
+    'export': ['site_export'],
+    'all': ['overlap_report', 'chains', 'unzoned', 'site_export'],
+}
+GEOMETRY_COMMANDS = ['zones', 'overlaps', 'export', 'all']
+
+
+def borough_names(city):
+    """Borough from the LCGMS City column, converted to title case for consistency"""
+    # Replace "Staten Is" with "Staten Island" only when not already "Staten Island"
+    return city.str.replace(r'(?i)staten\s+is(?!land)', 'Staten Island', regex=True).str.title()
+
+
+def full_addresses(schools_df):
+    """Combine the LCGMS address fields into a single 'street, city, state zip' column"""
+    def text(column):
+        # Format values the way an f-string would, missing values included
+        return schools_df[column].astype(str).fillna('nan')
+
+    return text('Primary Address') + ', ' + text('City') + ', ' + text('State Code') + ' ' + text('Zip')
+
+
+@stage('zone_dbns', files=[ELEMENTARY_ZONES_FILE, MIDDLE_ZONES_FILE, HIGH_ZONES_FILE])
+def load_zone_dbns():
+    """DBNs with a zone for each level, read without parsing the zone geometry"""
+    return {
+        'elementary': set(pd.read_csv(ELEMENTARY_ZONES_FILE, usecols=['DBN'])['DBN'].unique()),
+        'middle': set(pd.read_csv(MIDDLE_ZONES_FILE, usecols=['DBN'])['DBN'].unique()),
+        'high': set(pd.read_csv(HIGH_ZONES_FILE, usecols=['DBN'])['DBN'].unique()),
     }
-    
-    if name in final_mappings:
-        name = final_mappings[name]
-    
-    return name
 
-def main():
-    # Read the CSV files
-    lcgms_df = pd.read_csv('GeneralSchoolData/LCGMS_SchoolData_20251130_1323.csv')
 
-    # Filter for New York, Manhattan and Brooklyn (case insensitive)
-    # lcgms_df = lcgms_df[
-    #     lcgms_df['City'].str.lower().isin(['new york', 'manhattan', 'brooklyn'])
-    # ]
+@stage('zones', files=[ELEMENTARY_ZONES_FILE, MIDDLE_ZONES_FILE, HIGH_ZONES_FILE], code=['geometry_cache'])
+def load_zone_files():
+    """Load the zone files, geometry comes parsed from the cache when the files haven't changed"""
+    from geometry_cache import load_zones
+
+    elementary_zones_gdf = load_zones(ELEMENTARY_ZONES_FILE)
+    middle_zones_gdf = load_zones(MIDDLE_ZONES_FILE)
+    high_zones_gdf = load_zones(HIGH_ZONES_FILE)
+
+    return {
+        'elementary': elementary_zones_gdf,
+        'middle': middle_zones_gdf,
+        'high': high_zones_gdf,
+    }
 
-    # Read other files
-    elementary_zones_df = pd.read_csv('ZoningData/School_Zones_2024-2025_(Elementary_School)_20251130.csv')
-    middle_zones_df = pd.read_csv('ZoningData/School_Zones_2024-2025_(Middle_School)_20251130.csv')
-    high_zones_df = pd.read_csv('ZoningData/School_Zones_2024-2025_(High_School)_20251130.csv')
 
-    # Read the ranking files
-    elementary_rankings_df = pd.read_csv('RankingData/SchoolDigger/ElementarySchools.csv')
-    middle_rankings_df = pd.read_csv('RankingData/SchoolDigger/MiddleSchools.csv')
+def clean_rankings(elementary_rankings_df, middle_rankings_df, high_rankings_df):
+    """Add standardized name columns to the ranking frames for matching"""
+    elementary_rankings_df['Clean Name'] = clean_school_names(elementary_rankings_df['School Name'])
+    middle_rankings_df['Clean Name'] = clean_school_names(middle_rankings_df['School Name'])
+    high_rankings_df['Clean Name'] = clean_school_names(high_rankings_df['School Name'])
+
+    return {
+        'elementary': elementary_rankings_df,
+        'middle': middle_rankings_df,
+        'high': high_rankings_df,
+        # Extract Total Schools values from ranking dataframes
+        'total_elementary': elementary_rankings_df['Total Schools'].iloc[0],
+        'total_middle': middle_rankings_df['Total Schools'].iloc[0],
+        'total_high': high_rankings_df['Total Schools'].iloc[0],
+    }
+
+
+@stage('rankings', files=[ELEMENTARY_RANKINGS_FILE, MIDDLE_RANKINGS_FILE, HIGH_RANKINGS_FILE],
+       code=['school_names', clean_rankings])
+def load_rankings():
+    """Read the ranking files and add standardized name columns for matching"""
+    return clean_rankings(pd.read_csv(ELEMENTARY_RANKINGS_FILE), pd.read_csv(MIDDLE_RANKINGS_FILE),
+                          pd.read_csv(HIGH_RANKINGS_FILE))
 
-    # Extract Total Schools values from ranking dataframes
-    total_elementary_schools_ranked = elementary_rankings_df['Total Schools'].iloc[0]
-    total_middle_schools_ranked = middle_rankings_df['Total Schools'].iloc[0]
 
-    # Create standardized name columns for matching
-    lcgms_df['Clean Name'] = lcgms_df['Location Name'].apply(clean_school_name)
-    elementary_rankings_df['Clean Name'] = elementary_rankings_df['School Name'].apply(clean_school_name)
-    middle_rankings_df['Clean Name'] = middle_rankings_df['School Name'].apply(clean_school_name)
+def flag_zoned_schools(lcgms_df, zone_dbns):
+    """Add the standardized name and a zoned flag per level to the LCGMS schools"""
+    # Create standardized name column for matching
+    lcgms_df['Clean Name'] = clean_school_names(lcgms_df['Location Name'])
 
-    # Get unique DBN values from each zones file
-    elementary_dbns = set(elementary_zones_df['DBN'].unique())
-    middle_dbns = set(middle_zones_df['DBN'].unique())
-    high_dbns = set(high_zones_df['DBN'].unique())
+    # Unique DBN values from each zones file
+    elementary_dbns = zone_dbns['elementary']
+    middle_dbns = zone_dbns['middle']
+    high_dbns = zone_dbns['high']
 
     # Create new columns based on whether ATS System Code exists in respective zone files
-    lcgms_df['Zoned Elementary'] = lcgms_df['ATS System Code'].apply(
-        lambda x: 'Yes' if x in elementary_dbns else 'No'
-    )
-    lcgms_df['Zoned Middle'] = lcgms_df['ATS System Code'].apply(
-        lambda x: 'Yes' if x in middle_dbns else 'No'
-    )
-    lcgms_df['Zoned High'] = lcgms_df['ATS System Code'].apply(
-        lambda x: 'Yes' if x in high_dbns else 'No'
-    )
+    lcgms_df['Zoned Elementary'] = np.where(lcgms_df['ATS System Code'].isin(elementary_dbns), 'Yes', 'No')
+    lcgms_df['Zoned Middle'] = np.where(lcgms_df['ATS System Code'].isin(middle_dbns), 'Yes', 'No')
+    lcgms_df['Zoned High'] = np.where(lcgms_df['ATS System Code'].isin(high_dbns), 'Yes', 'No')
 
     # Print total schools count first
     print(f"Total number of schools in LCGMS: {len(lcgms_df)}")
+    return lcgms_df
+
+
+@stage('schools', inputs=['zone_dbns'], files=[LCGMS_FILE], code=['lcgms', 'school_names', flag_zoned_schools])
+def load_schools(zone_dbns):
+    """Read LCGMS and flag which schools are zoned for each level"""
+    lcgms_df = load_lcgms(LCGMS_FILE)
+
+    # Filter for New York, Manhattan and Brooklyn (case insensitive)
+    # lcgms_df = lcgms_df[
+    #     lcgms_df['City'].str.lower().isin(['new york', 'manhattan', 'brooklyn'])
+    # ]
+
+    return flag_zoned_schools(lcgms_df, zone_dbns)
+
 
+def attach_rankings(lcgms_df, rankings, match_store):
+    """Zoned schools with their SchoolDigger ranks, exact name matches first then fuzzy matches"""
     # Create a filtered dataframe with only zoned schools
     zoned_schools_df = lcgms_df[
         (lcgms_df['Zoned Elementary'] == 'Yes') |
         (lcgms_df['Zoned Middle'] == 'Yes') |
         (lcgms_df['Zoned High'] == 'Yes')
     ]
-    
+
     # Print count of schools zoned for at least one level
     print(f"\nNumber of schools zoned for at least one level: {len(zoned_schools_df)}")
     print(f"Number of zoned elementary schools: {(lcgms_df['Zoned Elementary'] == 'Yes').sum()}")
     print(f"Number of zoned middle schools: {(lcgms_df['Zoned Middle'] == 'Yes').sum()}")
     print(f"Number of zoned high schools: {(lcgms_df['Zoned High'] == 'Yes').sum()}")
 
-    # Create standardized name columns for matching (only for zoned schools)
-    zoned_schools_df.loc[:, 'Clean Name'] = zoned_schools_df['Location Name'].apply(clean_school_name)
+    # Merge elementary, middle and high school rankings separately
+    zoned_schools_df = pd.merge(
+        zoned_schools_df,
+        rankings['elementary'][['Clean Name', 'State Rank']].rename(columns={'State Rank': 'Elementary SchoolDigger Rank'}),
+        on='Clean Name',
+        how='left'
+    )
 
-    # Merge elementary and middle school rankings separately
     zoned_schools_df = pd.merge(
         zoned_schools_df,
-        elementary_rankings_df[['Clean Name', 'State Rank']].rename(columns={'State Rank': 'Elementary SchoolDigger Rank'}),
+        rankings['middle'][['Clean Name', 'State Rank']].rename(columns={'State Rank': 'Middle SchoolDigger Rank'}),
         on='Clean Name',
         how='left'
     )
-    
+
     zoned_schools_df = pd.merge(
         zoned_schools_df,
-        middle_rankings_df[['Clean Name', 'State Rank']].rename(columns={'State Rank': 'Middle SchoolDigger Rank'}),
+        rankings['high'][['Clean Name', 'State Rank']].rename(columns={'State Rank': 'High SchoolDigger Rank'}),
         on='Clean Name',
         how='left'
     )
 
-    # Fuzzy matching for unmatched schools using difflib
-    def fuzzy_match_rankings(zoned_df, ranking_df, rank_col_name):
-        # Identify unmatched schools
-        unmatched_mask = zoned_df[rank_col_name].isna()
-        unmatched_schools = zoned_df[unmatched_mask]
-        
-        # Get available ranking names that haven't been matched
-        matched_names = set(zoned_df[~unmatched_mask]['Clean Name'])
-        available_rankings = ranking_df[~ranking_df['Clean Name'].isin(matched_names)]
-        
-        if available_rankings.empty:
-            return zoned_df
-            
-        ranking_names = available_rankings['Clean Name'].tolist()
-        ranking_map = dict(zip(available_rankings['Clean Name'], available_rankings['State Rank']))
-        
-        print(f"Attempting fuzzy match for {len(unmatched_schools)} schools against {len(ranking_names)} rankings...")
-        
-        matches_found = 0
-        for idx, row in unmatched_schools.iterrows():
-            clean_name = row['Clean Name']
-            if not clean_name:
-                continue
-                
-            # Find best match using difflib
-            # cutoff=0.85 is a good balance for school names
-            matches = difflib.get_close_matches(clean_name, ranking_names, n=1, cutoff=0.85)
-            
-            if matches:
-                matched_name = matches[0]
-                rank = ranking_map[matched_name]
-                zoned_df.at[idx, rank_col_name] = rank
-                # print(f"Fuzzy match found: '{clean_name}' -> '{matched_name}'")
-                matches_found += 1
-                
-        print(f"Found {matches_found} additional matches via fuzzy matching")
-        return zoned_df
-
-    # Apply fuzzy matching
-    zoned_schools_df = fuzzy_match_rankings(zoned_schools_df, elementary_rankings_df, 'Elementary SchoolDigger Rank')
-    zoned_schools_df = fuzzy_match_rankings(zoned_schools_df, middle_rankings_df, 'Middle SchoolDigger Rank')
+    # Apply fuzzy matching, names resolved on earlier runs come from the match store
+    zoned_schools_df = fuzzy_match_rankings(zoned_schools_df, rankings['elementary'], 'Elementary SchoolDigger Rank',
+                                            store=match_store, source='SchoolDigger Elementary')
+    zoned_schools_df = fuzzy_match_rankings(zoned_schools_df, rankings['middle'], 'Middle SchoolDigger Rank',
+                                            store=match_store, source='SchoolDigger Middle')
+    zoned_schools_df = fuzzy_match_rankings(zoned_schools_df, rankings['high'], 'High SchoolDigger Rank',
+                                            store=match_store, source='SchoolDigger High')
 
     # Drop the temporary clean name column
     zoned_schools_df = zoned_schools_df.drop('Clean Name', axis=1)
@@ -217,36 +189,66 @@ def main():
     # Use the get method to avoid KeyError
     zoned_schools_df['Elementary SchoolDigger Rank'] = zoned_schools_df.get('Elementary SchoolDigger Rank', pd.Series()).fillna('Not Ranked')
     zoned_schools_df['Middle SchoolDigger Rank'] = zoned_schools_df.get('Middle SchoolDigger Rank', pd.Series()).fillna('Not Ranked')
+    zoned_schools_df['High SchoolDigger Rank'] = zoned_schools_df.get('High SchoolDigger Rank', pd.Series()).fillna('Not Ranked')
+    return zoned_schools_df
+
+
+@stage('matching', inputs=['schools', 'rankings'], state=[MATCH_STORE_FILE],
+       code=['fuzzy_matching', 'match_store', attach_rankings])
+def match_rankings(schools, rankings):
+    """Attach SchoolDigger ranks to zoned schools and save the unranked ones for debugging"""
+    match_store = MatchStore()
+    zoned_schools_df = attach_rankings(schools, rankings, match_store)
+    if match_store.save():
+        print(f"Saved new match resolutions to {MATCH_STORE_FILE}")
 
     # Print ranking statistics for zoned schools
     print("\nRanking Statistics (Zoned Schools Only):")
-    
+
     # Calculate unranked schools correctly by filtering for the specific level first
     unranked_elem = zoned_schools_df[
-        (zoned_schools_df['Zoned Elementary'] == 'Yes') & 
+        (zoned_schools_df['Zoned Elementary'] == 'Yes') &
         (zoned_schools_df['Elementary SchoolDigger Rank'] == 'Not Ranked')
     ]
-    
+
     unranked_middle = zoned_schools_df[
-        (zoned_schools_df['Zoned Middle'] == 'Yes') & 
+        (zoned_schools_df['Zoned Middle'] == 'Yes') &
         (zoned_schools_df['Middle SchoolDigger Rank'] == 'Not Ranked')
     ]
-    
+
+    unranked_high = zoned_schools_df[
+        (zoned_schools_df['Zoned High'] == 'Yes') &
+        (zoned_schools_df['High SchoolDigger Rank'] == 'Not Ranked')
+    ]
+
     print(f"Zoned schools not ranked in Elementary SchoolDigger: {len(unranked_elem)}")
     print(f"Zoned schools not ranked in Middle SchoolDigger: {len(unranked_middle)}")
+    print(f"Zoned schools not ranked in High SchoolDigger: {len(unranked_high)}")
 
     # Save unranked schools to CSV for debugging
     if not unranked_elem.empty:
         unranked_elem.to_csv('debug_unranked_elementary.csv', index=False)
         print("Saved unranked zoned elementary schools to 'debug_unranked_elementary.csv'")
-    
+
     if not unranked_middle.empty:
         unranked_middle.to_csv('debug_unranked_middle.csv', index=False)
         print("Saved unranked zoned middle schools to 'debug_unranked_middle.csv'")
 
+    if not unranked_high.empty:
+        unranked_high.to_csv('debug_unranked_high.csv', index=False)
+        print("Saved unranked zoned high schools to 'debug_unranked_high.csv'")
+
+    return zoned_schools_df
+
+
+@stage('school_table', inputs=['matching'], code=[borough_names, full_addresses])
+def build_school_table(matching):
+    """Simplified per-school table with borough, full address, zoning flags and ranks"""
+    zoned_schools_df = matching
+
     # Create simplified dataframe with selected columns
     simplified_columns = [
-        'ATS System Code', 
+        'ATS System Code',
         'Location Name',
         'Location Category Description',
         'Primary Address',
@@ -257,23 +259,20 @@ def main():
         'Zoned Middle',
         'Zoned High',
         'Elementary SchoolDigger Rank',
-        'Middle SchoolDigger Rank'
+        'Middle SchoolDigger Rank',
+        'High SchoolDigger Rank'
     ]
     simplified_df = zoned_schools_df[simplified_columns].copy()
-    
+
     # Add Borough column (same as City, converted to title case for consistency)
-    # Replace "Staten Is" with "Staten Island" only when not already "Staten Island"
-    simplified_df['Borough'] = simplified_df['City'].str.replace(r'(?i)staten\s+is(?!land)', 'Staten Island', regex=True).str.title()
-    
+    simplified_df['Borough'] = borough_names(simplified_df['City'])
+
     # Combine address fields into a single column
-    simplified_df['Full Address'] = simplified_df.apply(
-        lambda x: f"{x['Primary Address']}, {x['City']}, {x['State Code']} {x['Zip']}",
-        axis=1
-    )
-    
+    simplified_df['Full Address'] = full_addresses(simplified_df)
+
     # Drop individual address components and keep the combined address
     simplified_df = simplified_df.drop(['Primary Address', 'City', 'State Code', 'Zip'], axis=1)
-    
+
     # Reorder columns to put Full Address and Borough after Location Name
     final_columns = [
         'ATS System Code',
@@ -285,24 +284,91 @@ def main():
         'Zoned Middle',
         'Zoned High',
         'Elementary SchoolDigger Rank',
-        'Middle SchoolDigger Rank'
+        'Middle SchoolDigger Rank',
+        'High SchoolDigger Rank'
     ]
-    simplified_df = simplified_df[final_columns]
+    return simplified_df[final_columns]
+
+
+def school_details(school_table):
+    """School table indexed by DBN, the first row wins when a DBN repeats"""
+    school_table = school_table[school_table['ATS System Code'].notna()]
+    return school_table.drop_duplicates('ATS System Code', keep='first').set_index('ATS System Code')
+
+
+def numeric_ranks(ranks):
+    """SchoolDigger ranks as numbers, NaN for 'Not Ranked'"""
+    return pd.to_numeric(ranks, errors='coerce')
+
 
-    # Create two sorted versions of simplified_df
-    # Sort by Elementary SchoolDigger Rank
-    elementary_sorted_df = simplified_df.copy()
-    elementary_sorted_df['Sort Key'] = pd.to_numeric(elementary_sorted_df['Elementary SchoolDigger Rank'], errors='coerce')
-    elementary_sorted_df = elementary_sorted_df.sort_values('Sort Key', na_position='last').drop('Sort Key', axis=1)
+@stage('zone_geometry', inputs=['zones'], params=['simplify_tolerance'], code=['simplification'])
+def prepare_zone_geometry(zones, simplify_tolerance=None):
+    """Zones with a DBN for each level, simplified when a tolerance is set"""
+    from simplification import simplify_zones
 
-    # Sort by Middle SchoolDigger Rank
-    middle_sorted_df = simplified_df.copy()
-    middle_sorted_df['Sort Key'] = pd.to_numeric(middle_sorted_df['Middle SchoolDigger Rank'], errors='coerce')
-    middle_sorted_df = middle_sorted_df.sort_values('Sort Key', na_position='last').drop('Sort Key', axis=1)
+    elementary_zones_gdf = zones['elementary'][zones['elementary']['DBN'].notna()]
+    middle_zones_gdf = zones['middle'][zones['middle']['DBN'].notna()]
+    high_zones_gdf = zones['high'][zones['high']['DBN'].notna()]
+
+    if simplify_tolerance is not None:
+        elementary_zones_gdf, elementary_before, elementary_after = simplify_zones(elementary_zones_gdf, simplify_tolerance)
+        middle_zones_gdf, middle_before, middle_after = simplify_zones(middle_zones_gdf, simplify_tolerance)
+        high_zones_gdf, high_before, high_after = simplify_zones(high_zones_gdf, simplify_tolerance)
+        print(f"Simplified zones with tolerance {simplify_tolerance:g}: elementary {elementary_before} -> {elementary_after} vertices, "
+              f"middle {middle_before} -> {middle_after} vertices, high {high_before} -> {high_after} vertices")
+        count('vertices_before', elementary_before + middle_before + high_before)
+        count('vertices_after', elementary_after + middle_after + high_after)
+
+    return {
+        'elementary': elementary_zones_gdf,
+        'middle': middle_zones_gdf,
+        'high': high_zones_gdf,
+        'simplify_tolerance': simplify_tolerance,
+    }
+
+
+@stage('overlaps', inputs=['zone_geometry'], params=['drop_slivers'], options=['workers'],
+       code=['overlaps', 'simplification'])
+def compute_overlaps(zone_geometry, drop_slivers=False, workers=1):
+    """Overlapping elementary and middle/K-8 zone pairs for every zone with a DBN
+
+    This only depends on the zone geometry, ranking changes filter the pairs afterwards.
+    On simplified zones, pairs whose overlap is within the simplification error are flagged
+    as slivers, and dropped with drop_slivers. workers processes share the overlap computation,
+    the result doesn't depend on it.
+    """
+    from overlaps import find_zone_overlaps
+    from simplification import error_distance
+
+    tolerance = zone_geometry['simplify_tolerance']
+    overlaps_df, overlap_stats = find_zone_overlaps(
+        zone_geometry['elementary'],
+        zone_geometry['middle'],
+        workers=workers,
+        error_distance=error_distance(tolerance) if tolerance is not None else None,
+    )
+    print(f"Spatial index pruned {overlap_stats['pruned_pairs']} of {overlap_stats['total_pairs']} zone pairs "
+          f"({overlap_stats['candidate_pairs']} candidates, {overlap_stats['intersecting_pairs']} intersecting)")
+    count('pairs_tested', overlap_stats['candidate_pairs'])
+    count('pairs_overlapping', overlap_stats['overlapping_pairs'])
+
+    if 'sliver_pairs' in overlap_stats:
+        print(f"{overlap_stats['sliver_pairs']} overlapping pairs are slivers within the simplification error")
+        count('sliver_pairs', overlap_stats['sliver_pairs'])
+        if drop_slivers:
+            overlaps_df = overlaps_df[~overlaps_df['Sliver']].reset_index(drop=True)
+            print(f"Dropped the sliver pairs, {len(overlaps_df)} pairs left")
+    return overlaps_df
+
+
+def rank_overlap_pairs(zoned_schools_df, school_table, overlaps, rankings):
+    """Overlapping pairs of ranked schools with their school details, best average rank first"""
+    total_elementary_schools_ranked = rankings['total_elementary']
+    total_middle_schools_ranked = rankings['total_middle']
 
     # Get elementary schools and K-8/middle schools
     elementary_schools = zoned_schools_df[
-        (zoned_schools_df['Zoned Elementary'] == 'Yes') & 
+        (zoned_schools_df['Zoned Elementary'] == 'Yes') &
         (zoned_schools_df['Elementary SchoolDigger Rank'] != 'Not Ranked')
     ]['ATS System Code'].tolist()
 
@@ -312,110 +378,128 @@ def main():
         (zoned_schools_df['Middle SchoolDigger Rank'] != 'Not Ranked')
     ]['ATS System Code'].tolist()
 
-    k8_and_middle_schools1 = zoned_schools_df[
-        ((zoned_schools_df['Location Category Description'] == 'K-8') |
-         (zoned_schools_df['Zoned Middle'] == 'Yes'))
-    ]['ATS System Code'].tolist()
-
-    k8_and_middle_schools2 = zoned_schools_df[
-        (zoned_schools_df['Middle SchoolDigger Rank'] != 'Not Ranked')
-    ]['ATS System Code'].tolist()
-
     print(f"Number of ranked elementary schools: {len(elementary_schools)}")
     print(f"Number of ranked middle schools: {len(k8_and_middle_schools)}")
 
-    # Convert the_geom column to geometry using loads
-    elementary_zones_df['geometry'] = elementary_zones_df['the_geom'].apply(loads)
-    middle_zones_df['geometry'] = middle_zones_df['the_geom'].apply(loads)
-
-    # Convert to GeoDataFrames
-    elementary_zones_gdf = gpd.GeoDataFrame(elementary_zones_df, geometry='geometry')
-    middle_zones_gdf = gpd.GeoDataFrame(middle_zones_df, geometry='geometry')
-    
-    # Filter for relevant schools
-    elementary_zones_filtered = elementary_zones_gdf[elementary_zones_gdf['DBN'].isin(elementary_schools) & elementary_zones_gdf['DBN'].notna()]
-    middle_zones_filtered = middle_zones_gdf[middle_zones_gdf['DBN'].isin(k8_and_middle_schools) & middle_zones_gdf['DBN'].notna()]
-
-    print(f"Number of filtered elementary schools: {elementary_zones_filtered['DBN'].nunique()} (unique DBNs)")
-    print(f"Number of filtered middle schools: {middle_zones_filtered['DBN'].nunique()} (unique DBNs)")
-
-    # Find overlaps between elementary and middle/K-8 zones
-    overlaps = []
-    for _, elem_row in elementary_zones_filtered.iterrows():
-        for _, middle_row in middle_zones_filtered.iterrows():
-            if elem_row.geometry.intersects(middle_row.geometry):
-                overlap_area = elem_row.geometry.intersection(middle_row.geometry).area
-                if overlap_area > 0:
-                    overlaps.append({
-                        'Elementary_DBN': elem_row['DBN'],
-                        'Middle_K8_DBN': middle_row['DBN'],
-                        'Overlap_Area': overlap_area
-                    })
+    # Keep the pairs between relevant schools
+    overlaps_df = overlaps[
+        overlaps['Elementary_DBN'].isin(elementary_schools) &
+        overlaps['Middle_K8_DBN'].isin(k8_and_middle_schools)
+    ].reset_index(drop=True)
+    count('ranked_pairs', len(overlaps_df))
 
     # Create DataFrame of overlaps and merge with school names
-    if overlaps:
-        overlaps_df = pd.DataFrame(overlaps)
-        
-        # Get detailed school information for overlapping pairs
-        def get_detailed_school_info(dbn):
-            school = simplified_df[simplified_df['ATS System Code'] == dbn].iloc[0]  # Use simplified_df instead of zoned_schools_df
-            return {
-                'School_Name': school['Location Name'],
-                'School_Type': school['Location Category Description'],
-                'Borough': school['Borough'],
-                'Elementary_Rank': school['Elementary SchoolDigger Rank'],
-                'Middle_Rank': school['Middle SchoolDigger Rank'],
-                'Full_Address': school['Full Address']  # This will now be available
-            }
-
-        # Create a simplified overlaps DataFrame
-        simplified_overlaps = []
-        for _, row in overlaps_df.iterrows():
-            elem_info = get_detailed_school_info(row['Elementary_DBN'])
-            middle_info = get_detailed_school_info(row['Middle_K8_DBN'])
-            
-            # Convert ranks to numeric for averaging
-            elem_rank = pd.to_numeric(elem_info['Elementary_Rank'], errors='coerce')
-            middle_rank = pd.to_numeric(middle_info['Middle_Rank'], errors='coerce')
-            
-            # Calculate average rank (will be NaN if either rank is 'Not Ranked')
-            avg_rank = (elem_rank + middle_rank) / 2 if not (pd.isna(elem_rank) or pd.isna(middle_rank)) else float('inf')
-            
-            simplified_overlaps.append({
-                'Elementary_School': elem_info['School_Name'],
-                'Elementary_Borough': elem_info['Borough'],
-                'Elementary_SchoolDigger_Rank': elem_info['Elementary_Rank'],
-                'Elementary_Total_Schools': total_elementary_schools_ranked,
-                'Middle_School': middle_info['School_Name'],
-                'Middle_Borough': middle_info['Borough'],
-                'Middle_SchoolDigger_Rank': middle_info['Middle_Rank'],
-                'Middle_Total_Schools': total_middle_schools_ranked,
-                'Elementary_School_Type': elem_info['School_Type'],
-                'Middle_School_Type': middle_info['School_Type'],
-                'Elementary_Address': elem_info['Full_Address'],
-                'Middle_Address': middle_info['Full_Address'],
-                'Overlap_Area': row['Overlap_Area'],
-                'Average_Rank': avg_rank
-            })
-        
-        # Create and save simplified overlaps DataFrame
-        simplified_overlaps_df = pd.DataFrame(simplified_overlaps)
-        # Sort by Average_Rank (schools with no average rank will be at the end)
-        simplified_overlaps_df = simplified_overlaps_df.sort_values('Average_Rank')
-        # Drop the Average_Rank column before saving
-        simplified_overlaps_df = simplified_overlaps_df.drop('Average_Rank', axis=1)
-        simplified_overlaps_df = simplified_overlaps_df.drop_duplicates(subset=['Elementary_School', 'Middle_School'], keep='first')
-        simplified_overlaps_df.to_csv('Elementary_Middle_School_Overlaps_Simplified.csv', index=False)
-        print(f"Simplified overlaps data saved to Elementary_Middle_School_Overlaps_Simplified.csv")
-
-        # Save overlaps to CSV
-        # overlaps_df.to_csv('Elementary_Middle_School_Overlaps.csv', index=False)
-        # print(f"\nOverlapping elementary and middle/K-8 schools saved to Elementary_Middle_School_Overlaps.csv")
-        print(f"Found {len(overlaps_df)} overlapping pairs")
-        print(f"Number of unique elementary schools involved: {overlaps_df['Elementary_DBN'].nunique()}")
-        print(f"Number of unique middle/K-8 schools involved: {overlaps_df['Middle_K8_DBN'].nunique()}")
-    else:
+    if overlaps_df.empty:
         print("\nNo overlapping zones found between elementary and middle/K-8 schools")
+        return overlaps_df
+
+    school_info = school_details(school_table)[[
+        'Location Name', 'Borough', 'Elementary SchoolDigger Rank', 'Middle SchoolDigger Rank',
+        'Location Category Description', 'Full Address'
+    ]]
+    elem_info = school_info.loc[overlaps_df['Elementary_DBN']].reset_index(drop=True)
+    middle_info = school_info.loc[overlaps_df['Middle_K8_DBN']].reset_index(drop=True)
+
+    # Convert ranks to numeric for averaging
+    elem_rank = numeric_ranks(elem_info['Elementary SchoolDigger Rank'])
+    middle_rank = numeric_ranks(middle_info['Middle SchoolDigger Rank'])
+
+    # Create a simplified overlaps DataFrame
+    simplified_overlaps_df = pd.DataFrame({
+        'Elementary_DBN': overlaps_df['Elementary_DBN'],
+        'Middle_K8_DBN': overlaps_df['Middle_K8_DBN'],
+        'Elementary_School': elem_info['Location Name'],
+        'Elementary_Borough': elem_info['Borough'],
+        'Elementary_SchoolDigger_Rank': elem_info['Elementary SchoolDigger Rank'],
+        'Elementary_Total_Schools': total_elementary_schools_ranked,
+        'Middle_School': middle_info['Location Name'],
+        'Middle_Borough': middle_info['Borough'],
+        'Middle_SchoolDigger_Rank': middle_info['Middle SchoolDigger Rank'],
+        'Middle_Total_Schools': total_middle_schools_ranked,
+        'Elementary_School_Type': elem_info['Location Category Description'],
+        'Middle_School_Type': middle_info['Location Category Description'],
+        'Elementary_Address': elem_info['Full Address'],
+        'Middle_Address': middle_info['Full Address'],
+        'Overlap_Area': overlaps_df['Overlap_Area'],
+        # Average rank is inf when either school is 'Not Ranked'
+        'Average_Rank': ((elem_rank + middle_rank) / 2).fillna(float('inf')),
+    })
+
+    # Sort by Average_Rank (schools with no average rank will be at the end)
+    simplified_overlaps_df = simplified_overlaps_df.sort_values('Average_Rank')
+    # Drop the Average_Rank column before saving
+    simplified_overlaps_df = simplified_overlaps_df.drop('Average_Rank', axis=1)
+    simplified_overlaps_df = simplified_overlaps_df.drop_duplicates(subset=['Elementary_School', 'Middle_School'], keep='first')
+
+    print(f"Found {len(overlaps_df)} overlapping pairs")
+    print(f"Number of unique elementary schools involved: {overlaps_df['Elementary_DBN'].nunique()}")
+    print(f"Number of unique middle/K-8 schools involved: {overlaps_df['Middle_K8_DBN'].nunique()}")
+    return simplified_overlaps_df
+
+
+def save_overlap_report(simplified_overlaps_df, path):
+    """Save the overlap report CSV, the DBNs are kept for the site export but aren't part of it"""
+    simplified_overlaps_df.drop(['Elementary_DBN', 'Middle_K8_DBN'], axis=1).to_csv(path, index=False)
+    print(f"Simplified overlaps data saved to {path}")
+
+
+@stage('overlap_report', inputs=['matching', 'school_table', 'overlaps', 'rankings'], outputs=[OVERLAPS_OUTPUT_FILE],
+       code=[rank_overlap_pairs, save_overlap_report, school_details, numeric_ranks])
+def build_overlap_report(matching, school_table, overlaps, rankings):
+    """Join overlapping pairs of ranked schools with their school details and save them"""
+    simplified_overlaps_df = rank_overlap_pairs(matching, school_table, overlaps, rankings)
+    if not simplified_overlaps_df.empty:
+        save_overlap_report(simplified_overlaps_df, OVERLAPS_OUTPUT_FILE)
+    return simplified_overlaps_df
+
+
+@stage('chains', inputs=['overlaps', 'zone_geometry', 'school_table'], outputs=[CHAINS_OUTPUT_FILE],
+       code=['overlaps', school_details, numeric_ranks])
+def build_chains(overlaps, zone_geometry, school_table):
+    """Elementary, middle and high school zones serving the same area, ranked by combined rank, and save them"""
+    from overlaps import find_zone_chains
+
+    chains_df, chain_stats = find_zone_chains(overlaps, zone_geometry['high'])
+    print(f"Found {chain_stats['chains']} elementary/middle/high zone chains from {chain_stats['overlap_pairs']} "
+          f"overlapping pairs ({chain_stats['candidate_triples']} candidates)")
+    count('chain_candidates', chain_stats['candidate_triples'])
+    count('chains', chain_stats['chains'])
+
+    school_info = school_details(school_table)
+    elem_info = school_info.reindex(chains_df['Elementary_DBN']).reset_index(drop=True)
+    middle_info = school_info.reindex(chains_df['Middle_K8_DBN']).reset_index(drop=True)
+    high_info = school_info.reindex(chains_df['High_DBN']).reset_index(drop=True)
+
+    elem_rank = numeric_ranks(elem_info['Elementary SchoolDigger Rank'])
+    middle_rank = numeric_ranks(middle_info['Middle SchoolDigger Rank'])
+    high_rank = numeric_ranks(high_info['High SchoolDigger Rank'])
+
+    chain_report_df = pd.DataFrame({
+        'Elementary_DBN': chains_df['Elementary_DBN'],
+        'Elementary_School': elem_info['Location Name'],
+        'Elementary_SchoolDigger_Rank': elem_info['Elementary SchoolDigger Rank'],
+        'Middle_K8_DBN': chains_df['Middle_K8_DBN'],
+        'Middle_School': middle_info['Location Name'],
+        'Middle_SchoolDigger_Rank': middle_info['Middle SchoolDigger Rank'],
+        'High_DBN': chains_df['High_DBN'],
+        'High_School': high_info['Location Name'],
+        'High_SchoolDigger_Rank': high_info['High SchoolDigger Rank'],
+        'Chain_Area': chains_df['Chain_Area'],
+        # Combined rank is NaN when any of the three schools is 'Not Ranked'
+        'Combined_Rank': (elem_rank + middle_rank + high_rank) / 3,
+    })
+
+    # Best combined rank first, chains without one at the end, larger areas first within a rank
+    chain_report_df = chain_report_df.sort_values(['Combined_Rank', 'Chain_Area'], ascending=[True, False], na_position='last')
+    chain_report_df.to_csv(CHAINS_OUTPUT_FILE, index=False)
+    print(f"Zone chains saved to {CHAINS_OUTPUT_FILE}")
+    return chain_report_df
+
+
+@stage('unzoned', inputs=['schools'], outputs=[UNZONED_OUTPUT_FILE], code=[borough_names, full_addresses])
+def build_unzoned_schools(schools):
+    """Save the schools that aren't zoned for any level"""
+    lcgms_df = schools
 
     # Create a dataframe for unzoned schools
     unzoned_schools_df = lcgms_df[
@@ -425,11 +509,8 @@ def main():
     ].copy()
 
     # Add Borough and Full Address to unzoned schools dataframe
-    unzoned_schools_df['Borough'] = unzoned_schools_df['City'].str.replace(r'(?i)staten\s+is(?!land)', 'Staten Island', regex=True).str.title()
-    unzoned_schools_df['Full Address'] = unzoned_schools_df.apply(
-        lambda x: f"{x['Primary Address']}, {x['City']}, {x['State Code']} {x['Zip']}",
-        axis=1
-    )
+    unzoned_schools_df['Borough'] = borough_names(unzoned_schools_df['City'])
+    unzoned_schools_df['Full Address'] = full_addresses(unzoned_schools_df)
 
     # Select and reorder columns for the unzoned schools CSV
     unzoned_columns = [
@@ -445,20 +526,80 @@ def main():
     unzoned_simplified_df = unzoned_schools_df[unzoned_columns]
 
     # Save the unzoned schools to a CSV file
-    unzoned_simplified_df.to_csv('unzoned_schools.csv', index=False)
-    print(f"\nUnzoned schools data saved to unzoned_schools.csv")
-
-
-    # Save all dataframes to CSV files
-    # lcgms_df.to_csv('LCGMS_SchoolData_with_Zones.csv', index=False)
-    # zoned_schools_df.to_csv('LCGMS_SchoolData_Zoned_Only.csv', index=False)
-    # elementary_sorted_df.to_csv('LCGMS_SchoolData_Simplified_Elementary.csv', index=False)
-    # middle_sorted_df.to_csv('LCGMS_SchoolData_Simplified_Middle.csv', index=False)
-    # print(f"\nFiles saved:")
-    # print(f"All schools data saved to LCGMS_SchoolData_with_Zones.csv")
-    # print(f"Zoned schools only data saved to LCGMS_SchoolData_Zoned_Only.csv")
-    # print(f"Elementary SchoolDigger ranked data saved to LCGMS_SchoolData_Simplified_Elementary.csv")
-    # print(f"Middle SchoolDigger ranked data saved to LCGMS_SchoolData_Simplified_Middle.csv")
+    unzoned_simplified_df.to_csv(UNZONED_OUTPUT_FILE, index=False)
+    print(f"\nUnzoned schools data saved to {UNZONED_OUTPUT_FILE}")
+    return unzoned_simplified_df
+
+
+@stage('site_export', inputs=['overlap_report', 'school_table', 'unzoned', 'rankings'],
+       outputs=[SITE_MANIFEST_FILE], code=['site_export', school_details])
+def build_site_export(overlap_report, school_table, unzoned, rankings):
+    """Write the compact per-borough site data and compare its size with the CSVs"""
+    manifest, export_stats = export_site_data(
+        overlap_report,
+        school_details(school_table),
+        unzoned,
+        {'elementary': rankings['total_elementary'], 'middle': rankings['total_middle']},
+        csv_files=[OVERLAPS_OUTPUT_FILE, UNZONED_OUTPUT_FILE],
+    )
+    print(f"\nSite data saved to {SITE_DATA_DIR}/, {export_stats['files']} files: "
+          f"{export_stats['artifact_bytes'] / 1024:.1f} KB ({export_stats['artifact_gzip_bytes'] / 1024:.1f} KB gzipped), "
+          f"largest file {export_stats['largest_file_bytes'] / 1024:.1f} KB")
+    print(f"CSV baseline: {export_stats['csv_bytes'] / 1024:.1f} KB ({export_stats['csv_gzip_bytes'] / 1024:.1f} KB gzipped)")
+    count('artifact_bytes', export_stats['artifact_bytes'])
+    count('csv_bytes', export_stats['csv_bytes'])
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process NYC school zoning and ranking data')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    descriptions = {
+        'match': 'match zoned schools to their SchoolDigger ranks',
+        'zones': 'load the zone geometry, simplified with --simplify',
+        'overlaps': 'compute the zone overlap report and the feeder chains',
+        'unzoned': 'write the schools that are not zoned for any level',
+        'export': 'write the compact site data',
+        'all': 'run every stage (the default)',
+    }
+    for command, description in descriptions.items():
+        command_parser = commands.add_parser(command, help=description, description=description)
+        command_parser.add_argument('--force', action='store_true', help='rerun every stage, ignoring cached results')
+        command_parser.add_argument('--from-stage', choices=list(STAGES), help='rerun this stage and everything downstream of it')
+        command_parser.add_argument('--profile', nargs='?', const=PROFILE_REPORT_FILE, metavar='REPORT',
+                                    help=f'record time, memory and row counts per stage to a JSON report (default: {PROFILE_REPORT_FILE})')
+        command_parser.add_argument('--cprofile', action='store_true',
+                                    help='with --profile, run stages under cProfile and dump the slowest one next to the report')
+        if command in GEOMETRY_COMMANDS:
+            command_parser.add_argument('--workers', type=int, default=1, metavar='N',
+                                        help='compute zone overlaps on N worker processes, sharded by school district')
+            command_parser.add_argument('--simplify', type=float, metavar='TOLERANCE',
+                                        help='simplify zone geometry before computing overlaps, tolerance in degrees (1e-5 is about a meter)')
+            command_parser.add_argument('--drop-slivers', action='store_true',
+                                        help='with --simplify, drop overlapping pairs whose overlap is within the simplification error')
+
+    # Without a command, run everything as before
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in descriptions and argv[0] not in ('-h', '--help'):
+        argv = ['all'] + argv
+    args = parser.parse_args(argv)
+    if args.from_stage and args.from_stage not in stage_order(COMMAND_TARGETS[args.command]):
+        parser.error(f"--from-stage {args.from_stage} isn't one of the stages '{args.command}' runs")
+    if getattr(args, 'drop_slivers', False) and args.simplify is None:
+        parser.error("--drop-slivers needs --simplify, slivers are only flagged on simplified zones")
+
+    profiler = StageProfiler(cprofile=args.cprofile) if args.profile else None
+    run_pipeline(
+        COMMAND_TARGETS[args.command],
+        force=args.force,
+        from_stage=args.from_stage,
+        profiler=profiler,
+        params={'simplify_tolerance': getattr(args, 'simplify', None), 'drop_slivers': getattr(args, 'drop_slivers', False)},
+        options={'workers': getattr(args, 'workers', 1)},
+    )
+    if profiler is not None:
+        profiler.write_report(args.profile)
+
 
 if __name__ == "__main__":
     main()
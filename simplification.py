@@ -0,0 +1,133 @@
+import argparse
+import math
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Coordinates are snapped to a grid this fraction of the simplify tolerance
+GRID_FRACTION = 0.1
+
+
+def grid_size(tolerance):
+    return tolerance * GRID_FRACTION
+
+
+def error_distance(tolerance):
+    """How far simplifying and then snapping can move any point of a zone boundary
+
+    Simplification keeps the boundary within tolerance of the original, snapping then moves
+    each vertex by at most half the grid diagonal.
+    """
+    return tolerance + grid_size(tolerance) * math.sqrt(2) / 2
+
+
+def overlap_error_bounds(intersections, distance):
+    """Estimated bound on the Overlap_Area change for each pair, from the overlap's perimeter
+
+    Every point of the overlap's boundary moves by about distance at most, so the area can only
+    change within a band that wide on either side of it. It is an estimate: snapping also
+    removes holes and parts thinner than the grid, whose boundary isn't part of the simplified
+    overlap. compare_with_exact counts the pairs it misses.
+    """
+    return 2 * distance * shapely.length(intersections)
+
+
+def simplify_geometries(geometries, tolerance):
+    """Topology preserving simplification followed by snapping coordinates to the grid"""
+    simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    snapped = shapely.set_precision(simplified, grid_size(tolerance))
+    # Drop the precision model set_precision attaches, it would make later overlays snap to the
+    # grid as well, but it doesn't survive WKB or pickling so cached zones would give other results
+    return shapely.from_wkb(shapely.to_wkb(snapped))
+
+
+def simplify_zones(zones_gdf, tolerance):
+    """Copy of a zone GeoDataFrame with simplified geometry, and its vertex counts before and after"""
+    geometries = zones_gdf.geometry.values
+    simplified = simplify_geometries(geometries, tolerance)
+    simplified_gdf = zones_gdf.copy()
+    simplified_gdf.geometry = simplified
+    return simplified_gdf, int(shapely.get_num_coordinates(geometries).sum()), int(shapely.get_num_coordinates(simplified).sum())
+
+
+def _best_time(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+def compare_with_exact(elementary_zones, middle_zones, tolerance, repeat=3):
+    """Overlaps on exact and simplified zones side by side: vertices, timing and area changes"""
+    from overlaps import find_zone_overlaps
+
+    simple_elementary, elementary_before, elementary_after = simplify_zones(elementary_zones, tolerance)
+    simple_middle, middle_before, middle_after = simplify_zones(middle_zones, tolerance)
+
+    # Pairs are matched by zone position, some DBNs have more than one zone
+    elementary_zones = elementary_zones.assign(DBN=np.arange(len(elementary_zones)))
+    middle_zones = middle_zones.assign(DBN=np.arange(len(middle_zones)))
+    simple_elementary = simple_elementary.assign(DBN=elementary_zones['DBN'])
+    simple_middle = simple_middle.assign(DBN=middle_zones['DBN'])
+
+    exact_seconds, (exact_df, _) = _best_time(lambda: find_zone_overlaps(elementary_zones, middle_zones), repeat)
+    simple_seconds, (simple_df, _) = _best_time(
+        lambda: find_zone_overlaps(simple_elementary, simple_middle, error_distance=error_distance(tolerance)), repeat
+    )
+
+    # Pairs missing on one side count as an overlap of 0 there
+    pairs = pd.merge(
+        exact_df, simple_df, on=['Elementary_DBN', 'Middle_K8_DBN'], how='outer', suffixes=('_Exact', '_Simplified')
+    )
+    exact_area = pairs['Overlap_Area_Exact'].fillna(0)
+    simple_area = pairs['Overlap_Area_Simplified'].fillna(0)
+    area_change = (simple_area - exact_area).abs()
+
+    return {
+        'tolerance': tolerance,
+        'vertices_before': elementary_before + middle_before,
+        'vertices_after': elementary_after + middle_after,
+        'exact_seconds': exact_seconds,
+        'simplified_seconds': simple_seconds,
+        'speedup': exact_seconds / simple_seconds,
+        'exact_pairs': len(exact_df),
+        'simplified_pairs': len(simple_df),
+        'pairs_lost': int(pairs['Overlap_Area_Simplified'].isna().sum()),
+        'pairs_gained': int(pairs['Overlap_Area_Exact'].isna().sum()),
+        'max_area_change': float(area_change.max()),
+        'slivers': int(simple_df['Sliver'].sum()),
+        # Lost pairs have no simplified overlap to bound, their exact area is reported instead
+        'max_lost_area': float(exact_area[pairs['Overlap_Area_Simplified'].isna()].max()) if pairs['Overlap_Area_Simplified'].isna().any() else 0.0,
+        'pairs_over_bound': int((area_change > pairs['Overlap_Error_Bound'].fillna(np.inf)).sum()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare zone overlaps on exact and simplified geometry')
+    parser.add_argument('tolerances', nargs='+', type=float, help='simplify tolerances, in degrees (1e-5 is about a meter)')
+    parser.add_argument('--repeat', type=int, default=3, help='time each overlap run this many times and keep the best')
+    args = parser.parse_args()
+
+    import script  # noqa: F401 registers the pipeline stages
+    from pipeline import run_pipeline
+
+    zones = run_pipeline(['zones'])['zones']
+    elementary_zones = zones['elementary'][zones['elementary']['DBN'].notna()]
+    middle_zones = zones['middle'][zones['middle']['DBN'].notna()]
+
+    for tolerance in args.tolerances:
+        result = compare_with_exact(elementary_zones, middle_zones, tolerance, repeat=args.repeat)
+        print(f"\nTolerance {tolerance:g}: {result['vertices_before']} -> {result['vertices_after']} vertices, "
+              f"overlaps in {result['simplified_seconds']:.3f}s vs {result['exact_seconds']:.3f}s exact ({result['speedup']:.2f}x)")
+        print(f"  {result['simplified_pairs']} overlapping pairs vs {result['exact_pairs']} exact, "
+              f"{result['pairs_lost']} lost (largest exact area {result['max_lost_area']:.3g}), {result['pairs_gained']} gained")
+        print(f"  Largest Overlap_Area change {result['max_area_change']:.3g}, {result['pairs_over_bound']} pairs over the error bound")
+        print(f"  {result['slivers']} pairs flagged as slivers within the error bound")
+
+
+if __name__ == "__main__":
+    main()
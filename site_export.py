@@ -0,0 +1,169 @@
+import gzip
+import json
+import os
+import re
+
+import pandas as pd
+
+# Where the compact site data is written, one manifest plus per-borough shards
+SITE_DATA_DIR = 'site_data'
+SITE_MANIFEST_FILE = os.path.join(SITE_DATA_DIR, 'manifest.json')
+
+# Bump when the layout of the files changes so the site can refuse data it doesn't understand
+SITE_DATA_VERSION = 1
+
+# Positional fields of the records in each file, stored once in the manifest.
+# schools.json is keyed by DBN, so its records leave out the leading 'dbn'.
+SCHOOL_FIELDS = ['dbn', 'name', 'type', 'borough', 'address', 'elementary_rank', 'middle_rank']
+PAIR_FIELDS = ['elementary', 'middle', 'overlap_area']
+UNZONED_FIELDS = ['dbn', 'name', 'type', 'address']
+
+# Shard for pairs and unzoned schools without a borough, so they aren't dropped from the site
+UNKNOWN_BOROUGH = 'Unknown'
+
+
+def _slug(borough):
+    return re.sub(r'[^a-z0-9]+', '_', borough.lower()).strip('_')
+
+
+def _rank(value):
+    """Integer SchoolDigger rank, None for 'Not Ranked'"""
+    rank = pd.to_numeric(value, errors='coerce')
+    return None if pd.isna(rank) else int(rank)
+
+
+def _text(value):
+    return None if pd.isna(value) else str(value).strip()
+
+
+def _write_json(data, path):
+    """Write compact JSON and return its size in bytes, raw and gzipped"""
+    content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return len(content), len(gzip.compress(content))
+
+
+def _clear_shards(directory):
+    """Remove the shards of a previous export, boroughs may have come and gone since"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+
+
+def _school_records(school_info, dbns):
+    """School record lists in SCHOOL_FIELDS order for the given DBNs"""
+    school_info = school_info.reindex(dbns)
+    return [
+        [dbn, _text(name), _text(school_type), _text(borough), _text(address), _rank(elementary_rank), _rank(middle_rank)]
+        for dbn, name, school_type, borough, address, elementary_rank, middle_rank in zip(
+            dbns,
+            school_info['Location Name'],
+            school_info['Location Category Description'],
+            school_info['Borough'],
+            school_info['Full Address'],
+            school_info['Elementary SchoolDigger Rank'],
+            school_info['Middle SchoolDigger Rank'],
+        )
+    ]
+
+
+def export_site_data(overlap_report, school_info, unzoned, totals, csv_files=(), output_dir=SITE_DATA_DIR):
+    """Write the overlap report and unzoned schools as compact, per-borough JSON shards
+
+    school_info is the school table indexed by DBN, as script.school_details returns it.
+
+    schools.json is the dictionary of every school in a pair, keyed by DBN, so names, addresses and
+    ranks are stored once. Each overlap shard holds the pairs whose elementary school is in that
+    borough as integer references into it, and each unzoned shard the unzoned schools of a
+    borough. The manifest lists the files with their sizes, the record fields and the ranked
+    school totals that every CSV row repeats.
+
+    Returns the manifest and size stats, raw and gzipped, of the files and of the CSVs.
+    """
+    overlaps_dir = os.path.join(output_dir, 'overlaps')
+    unzoned_dir = os.path.join(output_dir, 'unzoned')
+    _clear_shards(overlaps_dir)
+    _clear_shards(unzoned_dir)
+
+    manifest = {
+        'version': SITE_DATA_VERSION,
+        'fields': {'school': SCHOOL_FIELDS, 'pair': PAIR_FIELDS, 'unzoned': UNZONED_FIELDS},
+        'elementary_total_schools': int(totals['elementary']),
+        'middle_total_schools': int(totals['middle']),
+        'overlaps': {},
+        'unzoned': {},
+    }
+    sizes = []
+
+    # Dictionary of every school in a pair, keyed by DBN. Pairs refer to schools by their
+    # position in the dbns list, which fixes the order independently of JSON key order.
+    if overlap_report.empty:
+        codes, dbns = [], []
+    else:
+        codes, dbns = pd.factorize(pd.concat([overlap_report['Elementary_DBN'], overlap_report['Middle_K8_DBN']], ignore_index=True))
+        dbns = list(dbns)
+    schools = {record[0]: record[1:] for record in _school_records(school_info, dbns)}
+    path = os.path.join(output_dir, 'schools.json')
+    sizes.append(_write_json({'dbns': dbns, 'schools': schools}, path))
+    manifest['schools'] = {'file': 'schools.json', 'schools': len(schools), 'bytes': sizes[-1][0]}
+
+    # Overlap pairs, sharded by the elementary school's borough and kept in report order
+    if not overlap_report.empty:
+        pair_count = len(overlap_report)
+        pairs_df = pd.DataFrame({
+            'borough': overlap_report['Elementary_Borough'].fillna(UNKNOWN_BOROUGH).to_numpy(),
+            'elementary': codes[:pair_count],
+            'middle': codes[pair_count:],
+            'area': overlap_report['Overlap_Area'].to_numpy(),
+        })
+        for borough, shard_df in pairs_df.groupby('borough', sort=True, dropna=False):
+            pairs = [
+                [int(elementary), int(middle), float(area)]
+                for elementary, middle, area in zip(shard_df['elementary'], shard_df['middle'], shard_df['area'])
+            ]
+            path = os.path.join(overlaps_dir, f"{_slug(borough)}.json")
+            sizes.append(_write_json({'pairs': pairs}, path))
+            manifest['overlaps'][borough] = {
+                'file': os.path.relpath(path, output_dir),
+                'pairs': len(pairs),
+                'bytes': sizes[-1][0],
+            }
+
+    # Unzoned schools, sharded by borough
+    for borough, shard_df in unzoned.assign(Borough=unzoned['Borough'].fillna(UNKNOWN_BOROUGH)).groupby('Borough', sort=True, dropna=False):
+        records = [
+            [_text(dbn), _text(name), _text(school_type), _text(address)]
+            for dbn, name, school_type, address in zip(
+                shard_df['ATS System Code'], shard_df['Location Name'],
+                shard_df['Location Category Description'], shard_df['Full Address'],
+            )
+        ]
+        path = os.path.join(unzoned_dir, f"{_slug(borough)}.json")
+        sizes.append(_write_json({'schools': records}, path))
+        manifest['unzoned'][borough] = {
+            'file': os.path.relpath(path, output_dir),
+            'schools': len(records),
+            'bytes': sizes[-1][0],
+        }
+
+    sizes.append(_write_json(manifest, os.path.join(output_dir, 'manifest.json')))
+
+    # Compare against the CSVs the site reads today
+    csv_bytes = csv_gzip_bytes = 0
+    for csv_file in csv_files:
+        with open(csv_file, 'rb') as f:
+            content = f.read()
+        csv_bytes += len(content)
+        csv_gzip_bytes += len(gzip.compress(content))
+
+    stats = {
+        'files': len(sizes),
+        'artifact_bytes': sum(raw for raw, _ in sizes),
+        'artifact_gzip_bytes': sum(compressed for _, compressed in sizes),
+        'largest_file_bytes': max(raw for raw, _ in sizes),
+        'csv_bytes': csv_bytes,
+        'csv_gzip_bytes': csv_gzip_bytes,
+    }
+    return manifest, stats
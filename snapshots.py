@@ -0,0 +1,277 @@
+import argparse
+import glob
+import os
+import pickle
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import script
+from geometry_cache import load_zones
+from lcgms import load_lcgms
+from match_store import MatchStore
+from overlaps import find_zone_overlaps_incremental, geometry_hashes
+from pipeline import file_hash
+
+# Per-snapshot reports and the diffs between consecutive snapshots are written here
+SNAPSHOT_OUTPUT_DIR = 'snapshots'
+
+# Overlaps of the last processed snapshot by geometry hash, so reruns only compute what changed
+SNAPSHOT_OVERLAPS_CACHE = os.path.join('.cache', 'snapshots', 'overlaps.pkl')
+
+# Input files of a snapshot, relative to its directory. A snapshot directory has the same layout as the repo.
+SNAPSHOT_FILES = {
+    'lcgms': os.path.join('GeneralSchoolData', 'LCGMS_SchoolData_*.csv'),
+    'elementary_zones': os.path.join('ZoningData', 'School_Zones_*_(Elementary_School)_*.csv'),
+    'middle_zones': os.path.join('ZoningData', 'School_Zones_*_(Middle_School)_*.csv'),
+    'high_zones': os.path.join('ZoningData', 'School_Zones_*_(High_School)_*.csv'),
+    'elementary_rankings': os.path.join('RankingData', 'SchoolDigger', 'ElementarySchools.csv'),
+    'middle_rankings': os.path.join('RankingData', 'SchoolDigger', 'MiddleSchools.csv'),
+    'high_rankings': os.path.join('RankingData', 'SchoolDigger', 'HighSchools.csv'),
+}
+
+ZONE_FILES = ['elementary_zones', 'middle_zones', 'high_zones']
+SCHOOL_FILES = ['lcgms', 'elementary_rankings', 'middle_rankings', 'high_rankings'] + ZONE_FILES
+
+
+def find_snapshot(directory, name=None):
+    """Input files of the snapshot in directory, named after its zoning year and LCGMS date unless name is given"""
+    snapshot = {'directory': directory}
+    for key, pattern in SNAPSHOT_FILES.items():
+        # Only the directory is escaped, the patterns' * wildcards stay live
+        paths = sorted(glob.glob(os.path.join(glob.escape(directory), pattern)))
+        if len(paths) != 1:
+            raise ValueError(f"Expected one file matching {pattern} in {directory}, found {len(paths)}")
+        snapshot[key] = paths[0]
+
+    zone_year = re.search(r'School_Zones_([\d-]+)_', os.path.basename(snapshot['elementary_zones']))
+    lcgms_date = re.search(r'LCGMS_SchoolData_(\d+)', os.path.basename(snapshot['lcgms']))
+    snapshot['name'] = name or '_'.join(match.group(1) for match in [zone_year, lcgms_date] if match)
+    return snapshot
+
+
+def _zone_levels(zones_by_file, snapshot):
+    """Zones of a snapshot by level, the way the zones stage returns them"""
+    return {
+        'elementary': zones_by_file[snapshot['elementary_zones']],
+        'middle': zones_by_file[snapshot['middle_zones']],
+        'high': zones_by_file[snapshot['high_zones']],
+    }
+
+
+def _school_side(lcgms_file, elementary_rankings_file, middle_rankings_file, high_rankings_file, zone_dbns):
+    """Worker side: ranked school table of one snapshot, which doesn't depend on zone geometry
+
+    Returns the rankings, the zoned schools with ranks, the school table and the match store
+    entries this worker recorded. The store is saved by the parent process.
+    """
+    rankings = script.clean_rankings(pd.read_csv(elementary_rankings_file), pd.read_csv(middle_rankings_file),
+                                     pd.read_csv(high_rankings_file))
+    schools = script.flag_zoned_schools(load_lcgms(lcgms_file), zone_dbns)
+
+    match_store = MatchStore()
+    zoned_schools_df = script.attach_rankings(schools, rankings, match_store)
+    return {
+        'rankings': rankings,
+        'matching': zoned_schools_df,
+        'school_table': script.build_school_table(zoned_schools_df),
+        # Only what this worker resolved, so it can't undo another worker's entries
+        'match_store': match_store.recorded,
+    }
+
+
+def _load_previous_overlaps(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _zone_hashes(zones_gdf):
+    """Set of geometry hashes for each DBN"""
+    zones_gdf = zones_gdf[zones_gdf['DBN'].notna()]
+    hashes = pd.Series(geometry_hashes(zones_gdf.geometry.values), index=zones_gdf['DBN'].values)
+    return hashes.groupby(level=0).agg(frozenset)
+
+
+def diff_zones(before, after):
+    """Zones added, removed or with changed geometry between two snapshots, one row per level and DBN"""
+    rows = []
+    for level in ['elementary', 'middle', 'high']:
+        hashes_before = _zone_hashes(before[level])
+        hashes_after = _zone_hashes(after[level])
+        for dbn in sorted(set(hashes_before.index) | set(hashes_after.index)):
+            if dbn not in hashes_after.index:
+                rows.append((level, dbn, 'removed'))
+            elif dbn not in hashes_before.index:
+                rows.append((level, dbn, 'added'))
+            elif hashes_before[dbn] != hashes_after[dbn]:
+                rows.append((level, dbn, 'geometry changed'))
+    return pd.DataFrame(rows, columns=['Level', 'DBN', 'Change'])
+
+
+def diff_pairs(before, after):
+    """Overlapping zone pairs added or removed between two snapshots"""
+    def pair_areas(overlaps_df):
+        return overlaps_df.groupby(['Elementary_DBN', 'Middle_K8_DBN'])['Overlap_Area'].sum()
+
+    pairs = pd.merge(
+        pair_areas(before).rename('Overlap_Area_Before'), pair_areas(after).rename('Overlap_Area_After'),
+        left_index=True, right_index=True, how='outer',
+    ).reset_index()
+    pairs['Change'] = np.where(pairs['Overlap_Area_Before'].isna(), 'added', 'removed')
+    changed = pairs['Overlap_Area_Before'].isna() | pairs['Overlap_Area_After'].isna()
+    return pairs[changed][['Elementary_DBN', 'Middle_K8_DBN', 'Change', 'Overlap_Area_Before', 'Overlap_Area_After']]
+
+
+def diff_ranks(before, after):
+    """Schools in both snapshots whose elementary, middle or high SchoolDigger rank moved"""
+    ranks_before, ranks_after = script.school_details(before), script.school_details(after)
+    dbns = ranks_before.index.intersection(ranks_after.index)
+    rows = []
+    for level in ['Elementary', 'Middle', 'High']:
+        column = f'{level} SchoolDigger Rank'
+        rank_before = ranks_before.loc[dbns, column].astype(str)
+        rank_after = ranks_after.loc[dbns, column].astype(str)
+        moved = rank_before != rank_after
+        rows.append(pd.DataFrame({
+            'DBN': dbns[moved],
+            'School': ranks_after.loc[dbns[moved], 'Location Name'].to_numpy(),
+            'Level': level,
+            'Rank_Before': ranks_before.loc[dbns[moved], column].to_numpy(),
+            'Rank_After': ranks_after.loc[dbns[moved], column].to_numpy(),
+        }))
+    rank_moves_df = pd.concat(rows, ignore_index=True)
+    # Places moved up the ranking, missing when the school is unranked on either side
+    rank_moves_df['Move'] = script.numeric_ranks(rank_moves_df['Rank_Before']) - script.numeric_ranks(rank_moves_df['Rank_After'])
+    return rank_moves_df
+
+
+def find_snapshots(directories, names=None):
+    """find_snapshot for each directory, names override the names taken from the file names
+
+    Reports are written under the snapshot names, so names that repeat raise a ValueError.
+    """
+    if names is not None and len(names) != len(directories):
+        raise ValueError(f"Got {len(names)} names for {len(directories)} snapshots")
+    snapshots = [find_snapshot(directory, name) for directory, name in zip(directories, names or [None] * len(directories))]
+    seen = {}
+    for snapshot in snapshots:
+        if snapshot['name'] in seen:
+            raise ValueError(f"Snapshots {seen[snapshot['name']]} and {snapshot['directory']} are both named "
+                             f"{snapshot['name']}, give them distinct names with --names")
+        seen[snapshot['name']] = snapshot['directory']
+    return snapshots
+
+
+def run_snapshots(snapshots, workers=1, output_dir=SNAPSHOT_OUTPUT_DIR, overlaps_cache=SNAPSHOT_OVERLAPS_CACHE):
+    """Process the snapshots from find_snapshots and diff each one against the one before it
+
+    Every distinct input file is read once, snapshots whose school inputs are identical share
+    one ranked school table, and the school side of each snapshot runs in a worker process
+    while the overlaps are computed here. Overlaps are computed incrementally, only zones whose
+    geometry hash is new since the previous snapshot are intersected.
+    """
+    hashes = {path: file_hash(path) for snapshot in snapshots for key in SCHOOL_FILES for path in [snapshot[key]]}
+
+    # Each distinct zone file is parsed once, through the zone geometry cache
+    zones_by_hash = {}
+    zones_by_file = {}
+    for snapshot in snapshots:
+        for key in ZONE_FILES:
+            path = snapshot[key]
+            if hashes[path] not in zones_by_hash:
+                zones_by_hash[hashes[path]] = load_zones(path)
+            zones_by_file[path] = zones_by_hash[hashes[path]]
+    for snapshot in snapshots:
+        snapshot['zones'] = _zone_levels(zones_by_file, snapshot)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # School side jobs, one per distinct set of school inputs
+        jobs = {}
+        for snapshot in snapshots:
+            job_key = tuple(hashes[snapshot[key]] for key in SCHOOL_FILES)
+            if job_key not in jobs:
+                zone_dbns = {level: set(snapshot['zones'][level]['DBN'].unique()) for level in ['elementary', 'middle', 'high']}
+                jobs[job_key] = executor.submit(
+                    _school_side, snapshot['lcgms'], snapshot['elementary_rankings'], snapshot['middle_rankings'],
+                    snapshot['high_rankings'], zone_dbns
+                )
+            snapshot['school_job'] = job_key
+
+        # Overlaps in snapshot order while the workers run, each reusing the previous one's pairs
+        state = _load_previous_overlaps(overlaps_cache)
+        for snapshot in snapshots:
+            start = time.perf_counter()
+            snapshot_zones = snapshot['zones']
+            snapshot['overlaps'], overlap_stats, state = find_zone_overlaps_incremental(
+                snapshot_zones['elementary'][snapshot_zones['elementary']['DBN'].notna()],
+                snapshot_zones['middle'][snapshot_zones['middle']['DBN'].notna()],
+                state,
+            )
+            print(f"Overlaps for {snapshot['name']} in {time.perf_counter() - start:.2f}s: "
+                  f"{overlap_stats['new_elementary_zones']} new elementary and {overlap_stats['new_middle_zones']} new middle zones, "
+                  f"{overlap_stats['reused_pairs']} pairs reused, {overlap_stats['candidate_pairs']} candidates tested")
+
+        school_sides = {job_key: job.result() for job_key, job in jobs.items()}
+
+    os.makedirs(os.path.dirname(overlaps_cache), exist_ok=True)
+    with open(overlaps_cache, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Resolutions found by the workers go into the shared match store
+    match_store = MatchStore()
+    for school_side in school_sides.values():
+        match_store.merge(school_side['match_store'])
+    if match_store.save():
+        print(f"Saved new match resolutions to {match_store.path}")
+
+    for snapshot in snapshots:
+        school_side = school_sides[snapshot['school_job']]
+        report_df = script.rank_overlap_pairs(
+            school_side['matching'], school_side['school_table'], snapshot['overlaps'], school_side['rankings']
+        )
+        snapshot_dir = os.path.join(output_dir, snapshot['name'])
+        os.makedirs(snapshot_dir, exist_ok=True)
+        if not report_df.empty:
+            script.save_overlap_report(report_df, os.path.join(snapshot_dir, script.OVERLAPS_OUTPUT_FILE))
+
+    for before, after in zip(snapshots, snapshots[1:]):
+        diff_dir = os.path.join(output_dir, f"{before['name']}__{after['name']}")
+        os.makedirs(diff_dir, exist_ok=True)
+        zone_changes_df = diff_zones(before['zones'], after['zones'])
+        pair_changes_df = diff_pairs(before['overlaps'], after['overlaps'])
+        rank_moves_df = diff_ranks(school_sides[before['school_job']]['school_table'],
+                                   school_sides[after['school_job']]['school_table'])
+        zone_changes_df.to_csv(os.path.join(diff_dir, 'zone_changes.csv'), index=False)
+        pair_changes_df.to_csv(os.path.join(diff_dir, 'pair_changes.csv'), index=False)
+        rank_moves_df.to_csv(os.path.join(diff_dir, 'rank_moves.csv'), index=False)
+
+        print(f"\n{before['name']} -> {after['name']}: {len(zone_changes_df)} zones changed "
+              f"({', '.join(f'{count} {change}' for change, count in zone_changes_df['Change'].value_counts().items()) or 'none'}), "
+              f"{(pair_changes_df['Change'] == 'added').sum()} overlap pairs added, {(pair_changes_df['Change'] == 'removed').sum()} removed, "
+              f"{len(rank_moves_df)} rank moves")
+        print(f"Diff saved to {diff_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process several data snapshots and diff each against the one before')
+    parser.add_argument('directories', nargs='+', help='snapshot directories laid out like this repo, oldest first')
+    parser.add_argument('--names', nargs='+', metavar='NAME',
+                        help='names for the snapshots, in the same order, instead of the zoning year and LCGMS date')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes for the per-snapshot school tables')
+    parser.add_argument('--output-dir', default=SNAPSHOT_OUTPUT_DIR, help=f'where reports and diffs are written (default: {SNAPSHOT_OUTPUT_DIR})')
+    args = parser.parse_args()
+
+    try:
+        snapshots = find_snapshots(args.directories, names=args.names)
+    except ValueError as error:
+        parser.error(str(error))
+    run_snapshots(snapshots, workers=args.workers, output_dir=args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# School levels with zone files, and the rank column each level reports
+ZONE_LEVELS = {
+    'Elementary': 'Elementary SchoolDigger Rank',
+    'Middle': 'Middle SchoolDigger Rank',
+    'High': 'High SchoolDigger Rank',
+}
+
+
+class ZoneLookup:
+    """Answers "which zoned schools serve this lon/lat" for many points at once
+
+    The index over each level's zone polygons is built once, with prepared geometries,
+    and reused for every lookup() call.
+    """
+
+    def __init__(self, zones, school_table):
+        """zones maps a level in ZONE_LEVELS to its zone GeoDataFrame, school_table is the
+        per-school table from the pipeline (DBN, name and ranks)"""
+        from script import school_details
+
+        school_info = school_details(school_table)
+
+        self.levels = {}
+        for level, rank_column in ZONE_LEVELS.items():
+            level_zones = zones[level][zones[level]['DBN'].notna()]
+            geometries = level_zones.geometry.values.copy()
+            shapely.prepare(geometries)
+
+            dbns = level_zones['DBN'].to_numpy(dtype=object)
+            info = school_info.reindex(dbns)
+            self.levels[level] = {
+                'tree': shapely.STRtree(geometries),
+                'geometries': geometries,
+                'dbns': dbns,
+                'names': info['Location Name'].to_numpy(dtype=object),
+                'ranks': info[rank_column].to_numpy(dtype=object),
+            }
+
+    def lookup(self, lon, lat):
+        """Zoned DBN, school name and SchoolDigger rank for each level, one row per point
+
+        Points outside every zone of a level get missing values for it. When zones of a level
+        overlap, the first zone in file order wins.
+        """
+        points = shapely.points(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        result = {}
+        for level, rank_column in ZONE_LEVELS.items():
+            level_index = self.levels[level]
+            zone = self._first_zone(level_index, points)
+            found = zone >= 0
+
+            dbns = np.full(len(points), None, dtype=object)
+            names = np.full(len(points), None, dtype=object)
+            dbns[found] = level_index['dbns'][zone[found]]
+            names[found] = level_index['names'][zone[found]]
+            result[f'{level} DBN'] = dbns
+            result[f'{level} School'] = names
+
+            ranks = np.full(len(points), None, dtype=object)
+            ranks[found] = level_index['ranks'][zone[found]]
+            result[rank_column] = ranks
+        return pd.DataFrame(result)
+
+    @staticmethod
+    def _first_zone(level_index, points):
+        """Position of the first zone containing each point, -1 when there is none"""
+        # Bounding box candidates from the tree, then the exact test against the prepared zones
+        point_idx, zone_idx = level_index['tree'].query(points)
+        inside = shapely.intersects(level_index['geometries'][zone_idx], points[point_idx])
+        point_idx, zone_idx = point_idx[inside], zone_idx[inside]
+
+        order = np.lexsort((zone_idx, point_idx))
+        point_idx, zone_idx = point_idx[order], zone_idx[order]
+        points_found, first = np.unique(point_idx, return_index=True)
+
+        zone = np.full(len(points), -1, dtype=np.int64)
+        zone[points_found] = zone_idx[first]
+        return zone
+
+
+def load_zone_lookup():
+    """Build a ZoneLookup from the pipeline's cached zones and school table"""
+    import script  # noqa: F401 registers the pipeline stages
+    from pipeline import run_pipeline
+
+    results = run_pipeline(['zones', 'school_table'])
+    zones = results['zones']
+    return ZoneLookup(
+        {'Elementary': zones['elementary'], 'Middle': zones['middle'], 'High': zones['high']},
+        results['school_table'],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up the zoned schools serving lon/lat points')
+    parser.add_argument('points', nargs='?', help="CSV file with 'lon' and 'lat' columns")
+    parser.add_argument('--output', help='write the results to this CSV file instead of stdout')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='time a lookup of N random points across the city')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    zone_lookup = load_zone_lookup()
+    print(f"Built zone lookup in {time.perf_counter() - start:.2f}s")
+
+    if args.benchmark:
+        minx, miny, maxx, maxy = shapely.total_bounds(zone_lookup.levels['Elementary']['geometries'])
+        rng = np.random.default_rng(0)
+        lon = rng.uniform(minx, maxx, args.benchmark)
+        lat = rng.uniform(miny, maxy, args.benchmark)
+        start = time.perf_counter()
+        found = zone_lookup.lookup(lon, lat)
+        seconds = time.perf_counter() - start
+        print(f"Looked up {args.benchmark} points in {seconds:.3f}s ({args.benchmark / seconds:,.0f} points/s), "
+              f"{found['Elementary DBN'].notna().sum()} inside an elementary zone")
+
+    if args.points:
+        points_df = pd.read_csv(args.points)
+        found = pd.concat([points_df, zone_lookup.lookup(points_df['lon'], points_df['lat'])], axis=1)
+        if args.output:
+            found.to_csv(args.output, index=False)
+            print(f"Zoned schools for {len(found)} points saved to {args.output}")
+        else:
+            print(found.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()